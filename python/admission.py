@@ -0,0 +1,219 @@
+import math
+import os
+import threading
+import time
+from dotenv import load_dotenv
+import encoder
+import job_queue
+import provider_status
+import render_plans
+from kling_scheduler import scheduler as kling_scheduler, KLING_APPLICATION
+
+# Load environment variables
+load_dotenv()
+
+# Resources a request can spend, with each user's budget per hour
+HOURLY_BUDGETS = {
+    "kling_jobs": float(os.getenv("USER_KLING_JOBS_PER_HOUR", "40")),
+    "encode_seconds": float(os.getenv("USER_ENCODE_SECONDS_PER_HOUR", "1800")),
+    "avatar_minutes": float(os.getenv("USER_AVATAR_MINUTES_PER_HOUR", "10")),
+    # Sieve, ElevenLabs and fal calls that are not Kling jobs: summaries, TTS, stitching, image cutouts
+    "provider_calls": float(os.getenv("USER_PROVIDER_CALLS_PER_HOUR", "120")),
+}
+# Jobs one user may have running at once, across all endpoints
+USER_MAX_CONCURRENT_JOBS = int(os.getenv("USER_MAX_CONCURRENT_JOBS", "8"))
+
+# Load is shed once this much work is waiting on local encoders or the Kling queue
+MAX_PENDING_RENDERS = int(os.getenv("MAX_PENDING_RENDERS", str(2 * encoder.CPU_COUNT)))
+MAX_KLING_WAITING = int(os.getenv("MAX_KLING_WAITING", str(4 * kling_scheduler.max_concurrent)))
+# Queue job kinds that encode on this host's CPUs
+RENDER_JOB_KINDS = ["overlay_render", "overlay_preview", "overlay_final", "remove_background_video"]
+
+# Used when the length of the clips cannot be probed, and for adventures, whose clips do not exist yet
+DEFAULT_ENCODE_SECONDS = 30
+DEFAULT_AVATAR_MINUTES = 1
+ADVENTURE_SCENES = 4
+# Stages of an adventure that each make one provider call besides the per-scene summaries
+ADVENTURE_PROVIDER_STAGES = ("background_removal", "stitch", "tts")
+
+_lock = threading.Lock()
+# user -> resource -> (tokens left, last refill time)
+_buckets = {}
+# user -> jobs currently admitted
+_user_jobs = {}
+_pending_renders = 0
+_rejections = {"rate": 0, "concurrency": 0, "saturated": 0, "too_large": 0}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, status_code: int = 429, retry_after: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def cost(kling_jobs: int = 0, encode_seconds: float = 0, avatar_minutes: float = 0, renders: int = 0,
+         provider_calls: int = 0) -> dict:
+    # renders are local encodes; every Kling job, render and avatar counts as one job,
+    # and a request's other provider calls count as one job between them
+    return {
+        "kling_jobs": kling_jobs,
+        "encode_seconds": encode_seconds,
+        "avatar_minutes": avatar_minutes,
+        "provider_calls": provider_calls,
+        "renders": renders,
+        "jobs": kling_jobs + renders + (1 if avatar_minutes else 0) + (1 if provider_calls else 0),
+    }
+
+
+def adventure_cost(completed_stages=()) -> dict:
+    # A resumed adventure skips the stages it has checkpoints for, so only the rest is charged
+    done = set(completed_stages)
+    kling_done = sum(1 for stage in done if stage.startswith("kling_video_"))
+    summaries_done = sum(1 for stage in done if stage.startswith("summary_"))
+    provider_calls = ADVENTURE_SCENES - summaries_done + sum(1 for stage in ADVENTURE_PROVIDER_STAGES if stage not in done)
+    rendered = "final_overlay" in done
+    return cost(
+        kling_jobs=max(0, ADVENTURE_SCENES - kling_done),
+        encode_seconds=0 if rendered else DEFAULT_ENCODE_SECONDS,
+        avatar_minutes=0 if "avatar" in done else DEFAULT_AVATAR_MINUTES,
+        renders=0 if rendered else 1,
+        provider_calls=max(0, provider_calls),
+    )
+
+
+def _probed_seconds(url: str) -> float | None:
+    try:
+        return render_plans.probe_duration(url) or None
+    except Exception as e:
+        print(f"[admission] Could not probe {url}: {e}")
+        return None
+
+
+def estimate_encode_seconds(video_url: str) -> float:
+    # Encoding time is budgeted as seconds of video, so the cost is the source's length.
+    # Blocks on a network probe unless the URL was probed before
+    return _probed_seconds(video_url) or DEFAULT_ENCODE_SECONDS
+
+
+def estimate_avatar_minutes(audio_url: str) -> float:
+    # The avatar speaks the whole narration, so it runs as long as the audio
+    seconds = _probed_seconds(audio_url)
+    return round(seconds / 60, 2) if seconds else DEFAULT_AVATAR_MINUTES
+
+
+def _refilled(user_id: str, resource: str, now: float) -> float:
+    capacity = HOURLY_BUDGETS[resource]
+    tokens, updated_at = _buckets.setdefault(user_id, {}).get(resource, (capacity, now))
+    return min(capacity, tokens + (now - updated_at) * capacity / 3600)
+
+
+def _check_budgets(user_id: str, request_cost: dict, now: float) -> dict:
+    # Returns the refilled buckets; raises if any resource is short
+    refilled = {}
+    for resource, capacity in HOURLY_BUDGETS.items():
+        amount = request_cost[resource]
+        if not amount:
+            continue
+        if amount > capacity:
+            _rejections["too_large"] += 1
+            raise AdmissionRejected(f"Request needs {amount} {resource}, more than the hourly budget of {capacity}", status_code=413)
+
+        tokens = _refilled(user_id, resource, now)
+        if tokens < amount:
+            _rejections["rate"] += 1
+            wait = (amount - tokens) * 3600 / capacity
+            raise AdmissionRejected(f"Hourly {resource} budget used up", retry_after=math.ceil(wait))
+        refilled[resource] = tokens
+    return refilled
+
+
+def _expected_seconds(model: str, default: float) -> float:
+    stats = provider_status.duration_stats(model)
+    return stats["run_median"] if stats else default
+
+
+def pending_renders() -> int:
+    # In queue mode renders wait in the shared queue, which also holds the other API processes'
+    # renders and queued overlay_final jobs; renders admitted here but not yet enqueued still count
+    if job_queue.RENDER_MODE != "queue":
+        return _pending_renders
+    return max(_pending_renders, sum(job_queue.queue_stats(RENDER_JOB_KINDS).values()))
+
+
+def _check_saturation(request_cost: dict):
+    # Retry-After is roughly how long it takes for one running job to finish and free a slot
+    if request_cost["renders"] and pending_renders() >= MAX_PENDING_RENDERS:
+        _rejections["saturated"] += 1
+        retry_after = _expected_seconds("job:overlay_render", 60) / max(1, encoder.stats()["in_flight"])
+        raise AdmissionRejected("Render capacity is saturated", retry_after=math.ceil(retry_after))
+
+    if request_cost["kling_jobs"]:
+        stats = kling_scheduler.stats()
+        waiting = sum(stats["waiting"].values())
+        if waiting >= MAX_KLING_WAITING:
+            _rejections["saturated"] += 1
+            retry_after = _expected_seconds(KLING_APPLICATION, 300) / max(1, stats["running"])
+            raise AdmissionRejected("Kling capacity is saturated", retry_after=math.ceil(retry_after))
+
+
+def reserve(user_id: str, request_cost: dict, concurrent: bool = True):
+    # Charges the user's budgets; with concurrent=True the jobs also count as running until release()
+    global _pending_renders
+    now = time.time()
+    with _lock:
+        if request_cost["jobs"] > USER_MAX_CONCURRENT_JOBS:
+            _rejections["too_large"] += 1
+            raise AdmissionRejected(f"Request has more than {USER_MAX_CONCURRENT_JOBS} jobs", status_code=413)
+        _check_saturation(request_cost)
+        if concurrent and _user_jobs.get(user_id, 0) + request_cost["jobs"] > USER_MAX_CONCURRENT_JOBS:
+            _rejections["concurrency"] += 1
+            raise AdmissionRejected(f"At most {USER_MAX_CONCURRENT_JOBS} jobs may run at once", retry_after=5)
+
+        refilled = _check_budgets(user_id, request_cost, now)
+        for resource, tokens in refilled.items():
+            _buckets[user_id][resource] = (tokens - request_cost[resource], now)
+
+        if concurrent:
+            _user_jobs[user_id] = _user_jobs.get(user_id, 0) + request_cost["jobs"]
+            _pending_renders += request_cost["renders"]
+
+
+def release(user_id: str, request_cost: dict):
+    global _pending_renders
+    with _lock:
+        remaining = _user_jobs.get(user_id, 0) - request_cost["jobs"]
+        if remaining > 0:
+            _user_jobs[user_id] = remaining
+        else:
+            _user_jobs.pop(user_id, None)
+        _pending_renders -= request_cost["renders"]
+
+
+def user_usage(user_id: str) -> dict:
+    now = time.time()
+    with _lock:
+        return {
+            "jobs_running": _user_jobs.get(user_id, 0),
+            "max_concurrent_jobs": USER_MAX_CONCURRENT_JOBS,
+            "budget_remaining": {
+                resource: round(_refilled(user_id, resource, now), 2) for resource in HOURLY_BUDGETS
+            },
+            "hourly_budgets": HOURLY_BUDGETS,
+        }
+
+
+def utilization() -> dict:
+    with _lock:
+        admitted = {
+            "pending_renders": pending_renders(),
+            "max_pending_renders": MAX_PENDING_RENDERS,
+            "users_with_jobs": len(_user_jobs),
+            "rejections": dict(_rejections),
+        }
+    return {
+        **admitted,
+        "kling": {**kling_scheduler.stats(), "max_waiting": MAX_KLING_WAITING},
+        "encoder": encoder.stats(),
+        "job_queue": job_queue.queue_stats(),
+    }
@@ -0,0 +1,166 @@
+import asyncio
+import checkpoints
+import gemini
+import job_queue
+from fal import generate_kling_video, generate_ffmpeg_comp
+from tts import tts_from_script
+from veed import generate_avatar_video
+from video_summary import summarize_video_async
+
+SUMMARY_PROMPT = "Summarise the video as if you were a David Attenborough style wildlife presenter"
+
+# Adventures currently being driven by this process
+_running_tasks: dict[str, asyncio.Task] = {}
+
+
+async def _in_executor(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fn, *args)
+
+
+async def run_stage(adventure_id: str, stage: str, inputs: dict, produce):
+    # Reuse the checkpointed output when the stage already ran with the same inputs
+    cached = checkpoints.get_stage(adventure_id, stage)
+    if cached is not None and cached["inputs"] == inputs:
+        print(f"[adventure {adventure_id}] Skipping {stage}, checkpoint found")
+        return cached["output"]
+
+    print(f"[adventure {adventure_id}] Running {stage}")
+    output = await produce()
+    checkpoints.save_stage(adventure_id, stage, inputs, output)
+    return output
+
+
+async def _create_scenes(prompt: str) -> dict:
+    scenes = await _in_executor(gemini.create_pet_scenes, prompt)
+    if scenes is None:
+        raise Exception("Scene generation failed")
+    return scenes.model_dump()
+
+
+async def _remove_background(image_url: str) -> str:
+    result = await job_queue.run_job("remove_background_image", {"image_url": image_url})
+    return result["background_removed_url"]
+
+
+async def _create_script(summaries: list[str], scenes: dict) -> dict:
+    script = await _in_executor(gemini.create_pet_script, summaries, scenes)
+    if script is None:
+        raise Exception("Script generation failed")
+    return script.model_dump()
+
+
+async def _tts(text: str) -> str:
+    audio_url = await _in_executor(tts_from_script, text)
+    if not audio_url:
+        raise Exception("Text to speech failed")
+    return audio_url
+
+
+async def _avatar_background_removal(avatar_video_url: str) -> str:
+    result = await job_queue.run_job("remove_background_video", {"video_url": avatar_video_url})
+    result_url = result["background_removed_url"]
+    if not result_url:
+        raise Exception("Avatar background removal failed")
+    return result_url
+
+
+async def _final_overlay(background_url: str, overlay_url: str) -> str:
+    result = await job_queue.run_job("overlay_render", {"background_url": background_url, "overlay_url": overlay_url})
+    return result["video_url"]
+
+
+async def run_adventure(adventure_id: str) -> dict:
+    adventure = checkpoints.get_adventure(adventure_id)
+    prompt = adventure["inputs"]["prompt"]
+    image_url = adventure["inputs"]["image_url"]
+    user_id = adventure["inputs"].get("user_id", "anonymous")
+
+    # Scene generation and background removal do not depend on each other
+    scenes, pet_image_url = await asyncio.gather(
+        run_stage(adventure_id, "scenes", {"prompt": prompt}, lambda: _create_scenes(prompt)),
+        run_stage(adventure_id, "background_removal", {"image_url": image_url}, lambda: _remove_background(image_url)),
+    )
+
+    # One checkpoint per clip so a single failed Kling job does not re-run the others
+    scene_prompts = list(scenes.values())
+    clips = await asyncio.gather(*[
+        run_stage(
+            adventure_id,
+            f"kling_video_{index}",
+            {"prompt": scene_prompt, "image_url": pet_image_url},
+            lambda scene_prompt=scene_prompt: generate_kling_video(scene_prompt, pet_image_url, user_id=user_id),
+        )
+        for index, scene_prompt in enumerate(scene_prompts)
+    ])
+    clip_urls = [clip["video"]["url"] for clip in clips]
+
+    stitched, summaries = await asyncio.gather(
+        run_stage(adventure_id, "stitch", {"scenes": clip_urls}, lambda: generate_ffmpeg_comp(clip_urls)),
+        asyncio.gather(*[
+            run_stage(
+                adventure_id,
+                f"summary_{index}",
+                {"video_url": clip_url, "prompt": SUMMARY_PROMPT},
+                lambda clip_url=clip_url: summarize_video_async(clip_url, SUMMARY_PROMPT),
+            )
+            for index, clip_url in enumerate(clip_urls)
+        ]),
+    )
+
+    scenes_by_key = {f"scene{index + 1}": scene for index, scene in enumerate(scene_prompts)}
+    script = await run_stage(
+        adventure_id,
+        "script",
+        {"video_summaries": summaries, "scenes": scenes_by_key},
+        lambda: _create_script(summaries, scenes_by_key),
+    )
+
+    script_text = " ".join(script.values())
+    audio_url = await run_stage(adventure_id, "tts", {"text": script_text}, lambda: _tts(script_text))
+
+    avatar = await run_stage(adventure_id, "avatar", {"audio_url": audio_url}, lambda: generate_avatar_video(audio_url))
+    avatar_video_url = avatar["video"]["url"]
+    avatar_overlay_url = await run_stage(
+        adventure_id,
+        "avatar_background_removal",
+        {"video_url": avatar_video_url},
+        lambda: _avatar_background_removal(avatar_video_url),
+    )
+
+    stitched_url = stitched["video_url"]
+    final_url = await run_stage(
+        adventure_id,
+        "final_overlay",
+        {"background_url": stitched_url, "overlay_url": avatar_overlay_url},
+        lambda: _final_overlay(stitched_url, avatar_overlay_url),
+    )
+
+    return {"video_url": final_url}
+
+
+async def _drive_adventure(adventure_id: str):
+    checkpoints.set_adventure_status(adventure_id, "running")
+    try:
+        await run_adventure(adventure_id)
+        checkpoints.set_adventure_status(adventure_id, "completed")
+    except asyncio.CancelledError:
+        checkpoints.set_adventure_status(adventure_id, "cancelled")
+        raise
+    except Exception as e:
+        print(f"[adventure {adventure_id}] Failed: {e}")
+        checkpoints.set_adventure_status(adventure_id, "failed", str(e))
+    finally:
+        _running_tasks.pop(adventure_id, None)
+
+
+def is_running(adventure_id: str) -> bool:
+    return adventure_id in _running_tasks
+
+
+def start_adventure(adventure_id: str) -> bool:
+    # Returns False when this adventure is already running in this process
+    if adventure_id in _running_tasks:
+        return False
+    _running_tasks[adventure_id] = asyncio.create_task(_drive_adventure(adventure_id))
+    return True
@@ -0,0 +1,251 @@
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from ffmpeg_tools import ffmpeg_exe
+from lazy_imports import lazy_import
+from render_plans import probe
+from workspace import Workspace
+
+moviepy = lazy_import("moviepy")
+
+# Usage: python audio_mix.py [seconds]
+# Benchmarks the ffmpeg mix against moviepy's CompositeAudioClip on synthetic stems and exits
+# non-zero if it is not faster or its level is more than LOUDNESS_TOLERANCE_LU off target.
+
+# Bed levels relative to each track's own level; narration stays at 0 dB
+BACKGROUND_GAIN_DB = -6
+MUSIC_GAIN_DB = -10
+
+# Beds duck under the narration
+DUCK_THRESHOLD = 0.03
+DUCK_RATIO = 8
+DUCK_ATTACK_MS = 20
+DUCK_RELEASE_MS = 400
+
+# EBU R128 targets for the final mix
+TARGET_LUFS = -16
+TARGET_TRUE_PEAK = -1.5
+# ebur128 reports this for silence
+SILENCE_LUFS = -70
+
+SAMPLE_RATE = 48000
+
+# The benchmark fails if the mix lands further than this from TARGET_LUFS
+LOUDNESS_TOLERANCE_LU = 1
+
+
+def _normalized(label: str, name: str, gain_db: float = 0) -> str:
+    # Common rate and layout so the multi-input filters can negotiate
+    return (
+        f"{label}aresample={SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+        f"volume={gain_db}dB[{name}]"
+    )
+
+
+def _mix_chains(narration: str, beds: list[tuple[str, float]], duration: float | None) -> list[str]:
+    # Gains, ducking and summing; the chains end in [mix]
+    chains = []
+    for index, (label, gain_db) in enumerate(beds):
+        chains.append(_normalized(label, f"bed{index}", gain_db))
+    if len(beds) > 1:
+        pads = "".join(f"[bed{index}]" for index in range(len(beds)))
+        chains.append(f"{pads}amix=inputs={len(beds)}:duration=longest:normalize=0[bed]")
+    elif beds:
+        chains.append("[bed0]anull[bed]")
+
+    if narration is None:
+        mixed = "[bed]"
+    else:
+        chains.append(_normalized(narration, "narration"))
+        if beds:
+            # The narration keys a compressor on the beds, then both are summed
+            chains.append("[narration]asplit=2[voice][key]")
+            chains.append(
+                f"[bed][key]sidechaincompress=threshold={DUCK_THRESHOLD}:ratio={DUCK_RATIO}"
+                f":attack={DUCK_ATTACK_MS}:release={DUCK_RELEASE_MS}[ducked]"
+            )
+            chains.append("[voice][ducked]amix=inputs=2:duration=longest:normalize=0[mixed]")
+            mixed = "[mixed]"
+        else:
+            mixed = "[narration]"
+
+    # Padded with silence or trimmed to exactly the video's length
+    fit = f"apad=whole_dur={duration:.3f},atrim=end={duration:.3f}" if duration else "anull"
+    chains.append(f"{mixed}{fit}[mix]")
+    return chains
+
+
+def _gain_filters(level: dict) -> str:
+    # One static gain to TARGET_LUFS; the limiter only runs when that gain would push peaks over the ceiling
+    if level["integrated"] <= SILENCE_LUFS:
+        return "anull"
+    gain_db = TARGET_LUFS - level["integrated"]
+    filters = f"volume={gain_db:.2f}dB"
+    if level["peak"] + gain_db > TARGET_TRUE_PEAK:
+        # Sample peak stands in for true peak, which would need 4x oversampling to measure
+        filters += f",alimiter=limit={10 ** (TARGET_TRUE_PEAK / 20):.4f}:level=0"
+    return filters
+
+
+def mix_graph(narration: str | None, beds: list[tuple[str, float]], level: dict | None = None,
+              duration: float | None = None) -> str | None:
+    # narration and bed labels are ffmpeg input pads like "[1:a]"; the graph ends in [a].
+    # level is measure_mix()'s result for the same inputs; without it the graph measures instead
+    # of normalising. With a duration the mix is padded or trimmed to exactly that length.
+    if narration is None and not beds:
+        return None
+
+    chains = _mix_chains(narration, beds, duration)
+    if level is None:
+        chains.append("[mix]ebur128=peak=sample:framelog=quiet[a]")
+    else:
+        chains.append(f"[mix]{_gain_filters(level)}[a]")
+    return ";".join(chains)
+
+
+def _parse_ebur128(stderr: str) -> dict:
+    # The last summary ebur128 logs when it closes
+    summary = stderr[stderr.rindex("Summary:"):]
+    integrated = re.search(r"I:\s+(-?[\d.]+|-inf) LUFS", summary).group(1)
+    peak = re.search(r"Peak:\s+(-?[\d.]+|-inf) dBFS", summary).group(1)
+    return {
+        "integrated": max(float(integrated), SILENCE_LUFS),
+        "peak": float(peak),
+    }
+
+
+def _run_ebur128(input_args: list[str], graph: str) -> dict:
+    # Decodes and analyses only; nothing is encoded or written
+    result = subprocess.run(
+        [ffmpeg_exe(), "-hide_banner", "-nostats", "-v", "info", *input_args,
+         "-filter_complex", graph, "-map", "[a]", "-f", "null", "-"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return _parse_ebur128(result.stderr)
+
+
+def measure_mix(input_args: list[str], narration: str | None, beds: list[tuple[str, float]],
+                duration: float | None = None) -> dict | None:
+    # Integrated loudness and sample peak of the mix, from a decode-only pass over the same inputs
+    graph = mix_graph(narration, beds, duration=duration)
+    if graph is None:
+        return None
+    try:
+        return _run_ebur128(input_args, graph)
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] ffmpeg stderr:\n{e.stderr}")
+        raise
+
+
+def mix_audio(output_path: str, narration_path: str | None, bed_paths: list[tuple[str, float]],
+              video_path: str | None = None, audio_bitrate: str | None = None,
+              workspace: Workspace | None = None, duration: float | None = None) -> str:
+    # Measures the mix, then mixes the tracks again with a static gain to TARGET_LUFS; with video_path
+    # the video stream is copied alongside and the audio is fitted to duration, the video's length.
+    # Passing the workspace the output goes to holds the mix to its quota.
+    input_args = []
+    offset = 0
+    if video_path:
+        input_args += ["-i", video_path]
+        offset = 1
+
+    beds = []
+    for index, (path, gain_db) in enumerate(bed_paths):
+        input_args += ["-i", path]
+        beds.append((f"[{offset + index}:a]", gain_db))
+    narration = None
+    if narration_path:
+        input_args += ["-i", narration_path]
+        narration = f"[{offset + len(bed_paths)}:a]"
+
+    if narration is None and not beds:
+        if not video_path:
+            raise ValueError("Nothing to mix")
+        os.replace(video_path, output_path)
+        return output_path
+
+    if video_path and not duration:
+        duration = probe(video_path)["duration"]
+    level = measure_mix(input_args, narration, beds, duration)
+
+    command = [ffmpeg_exe(), "-y", "-v", "error", *input_args,
+               "-filter_complex", mix_graph(narration, beds, level, duration)]
+    if video_path:
+        # The graph already pads or trims the audio to the video, so both streams end together
+        command += ["-map", "0:v", "-c:v", "copy"]
+    command += ["-map", "[a]", "-c:a", "aac"]
+    if audio_bitrate:
+        command += ["-b:a", audio_bitrate]
+    command.append(output_path)
+
+    try:
+        if workspace:
+            workspace.run(command)
+        else:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] ffmpeg stderr:\n{e.stderr}")
+        raise
+    return output_path
+
+
+def measure_loudness(path: str) -> float:
+    # Integrated loudness of a finished file in LUFS
+    return _run_ebur128(["-i", path], "[0:a]ebur128=framelog=quiet[a]")["integrated"]
+
+
+def _synthetic_stem(path: str, source: str, seconds: int, volume: str):
+    subprocess.run(
+        [ffmpeg_exe(), "-y", "-v", "error", "-f", "lavfi", "-i", f"{source}:duration={seconds}",
+         "-af", f"volume={volume}:eval=frame", "-ac", "2", "-c:a", "aac", path],
+        check=True,
+    )
+
+
+def _moviepy_mix(output_path: str, narration_path: str, bed_paths: list[tuple[str, float]]):
+    # The previous finale mix: plain sum, no gains, ducking or normalisation
+    clips = [moviepy.AudioFileClip(path) for path, _ in bed_paths] + [moviepy.AudioFileClip(narration_path)]
+    try:
+        moviepy.CompositeAudioClip(clips).write_audiofile(output_path, codec="aac", logger=None)
+    finally:
+        for clip in clips:
+            clip.close()
+
+
+def benchmark(seconds: int = 120):
+    with tempfile.TemporaryDirectory() as directory:
+        # Narration with pauses every few seconds, a loud music bed and a quiet background track
+        narration = f"{directory}/narration.m4a"
+        music = f"{directory}/music.m4a"
+        background = f"{directory}/background.m4a"
+        _synthetic_stem(narration, "sine=frequency=220", seconds, "'if(lt(mod(t,5),3),0.5,0)'")
+        _synthetic_stem(music, "anoisesrc=color=pink", seconds, "0.8")
+        _synthetic_stem(background, "sine=frequency=80", seconds, "0.2")
+        beds = [(background, BACKGROUND_GAIN_DB), (music, MUSIC_GAIN_DB)]
+
+        timings = {}
+        levels = {}
+        for name, mix in (("moviepy", _moviepy_mix), ("ffmpeg", mix_audio)):
+            output_path = f"{directory}/{name}.m4a"
+            started = time.monotonic()
+            mix(output_path, narration, beds)
+            timings[name] = time.monotonic() - started
+            levels[name] = measure_loudness(output_path)
+            print(f"{name:>8}: {timings[name]:6.2f}s for {seconds}s of audio, {levels[name]:6.1f} LUFS")
+        print(f"  target: {TARGET_LUFS} LUFS")
+
+    if timings["ffmpeg"] >= timings["moviepy"]:
+        print(f"FAIL: the ffmpeg mix took {timings['ffmpeg']:.2f}s, moviepy {timings['moviepy']:.2f}s")
+        sys.exit(1)
+    if abs(levels["ffmpeg"] - TARGET_LUFS) > LOUDNESS_TOLERANCE_LU:
+        print(f"FAIL: the ffmpeg mix is at {levels['ffmpeg']:.1f} LUFS, target {TARGET_LUFS} +/- {LOUDNESS_TOLERANCE_LU} LU")
+        sys.exit(1)
+    print("OK: the ffmpeg mix is faster and on target")
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 120)
@@ -0,0 +1,68 @@
+import os
+import jwt
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+# Projects still on the shared JWT secret sign access tokens with HS256; newer ones publish their keys
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = "authenticated"
+JWKS_CACHE_SECONDS = 3600
+
+# Proxies in front of the API that append the address they saw to X-Forwarded-For;
+# Cloud Run's front end is one, so the last entry is the caller
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# Prefix of the ids anonymous callers are budgeted under
+ANONYMOUS_PREFIX = "anon:"
+
+_jwks_client = None
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _signing_key(token: str) -> tuple:
+    global _jwks_client
+    if SUPABASE_JWT_SECRET:
+        return SUPABASE_JWT_SECRET, ["HS256"]
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json", lifespan=JWKS_CACHE_SECONDS)
+    return _jwks_client.get_signing_key_from_jwt(token).key, ["ES256", "RS256"]
+
+
+def verified_user_id(authorization: str | None) -> str | None:
+    # The Supabase user id from an "Authorization: Bearer <access token>" header, None without one
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise InvalidToken("Expected a Bearer token")
+
+    try:
+        key, algorithms = _signing_key(token)
+        claims = jwt.decode(
+            token,
+            key,
+            algorithms=algorithms,
+            audience=SUPABASE_JWT_AUDIENCE,
+            options={"require": ["sub", "exp"]},
+        )
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+    return claims["sub"]
+
+
+def client_address(forwarded_for: str | None, peer: str | None) -> str:
+    # Entries before the trusted proxies' are whatever the client sent, so count from the right
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    if TRUSTED_PROXY_HOPS and len(hops) >= TRUSTED_PROXY_HOPS:
+        return hops[-TRUSTED_PROXY_HOPS]
+    return peer or "unknown"
+
+
+def anonymous_id(forwarded_for: str | None, peer: str | None) -> str:
+    return ANONYMOUS_PREFIX + client_address(forwarded_for, peer)
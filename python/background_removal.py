@@ -1,31 +1,44 @@
 import os
+from collections import deque
 import requests
-import sieve
-from tempfile import NamedTemporaryFile
 from dotenv import load_dotenv
 import subprocess
-import shutil
+import encoder
+from ffmpeg_tools import ffmpeg_exe
 from supabase_utils import upload_to_supabase
+from workspace import job_workspace
+from cancellation import wait_sieve
+from lazy_imports import lazy_import
+
+sieve = lazy_import("sieve")
 
 # Load environment variables
 load_dotenv()
 
+# Largest photo set one batch request may hold
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "20"))
+# Sieve jobs one batch keeps running at once; the rest are pushed as those finish
+BATCH_CONCURRENCY = int(os.getenv("BATCH_BACKGROUND_REMOVAL_CONCURRENCY", "4"))
+
 
-def convert_mov_to_webm(input_path: str) -> str:
-    output_path = input_path.replace(".mov", ".webm")
+def convert_mov_to_webm(input_path: str, output_path: str = None) -> str:
+    output_path = output_path or input_path.replace(".mov", ".webm")
     print(f"[DEBUG] Starting conversion from MOV to WEBM (with transparency)")
     print(f"[DEBUG] Input path: {input_path}")
     print(f"[DEBUG] Output path: {output_path}")
 
     try:
-        result = subprocess.run([
-            "ffmpeg", "-y",  # Overwrite output if it exists
-            "-i", input_path,
-            "-c:v", "libvpx-vp9",          # Use VP9 codec
-            "-pix_fmt", "yuva420p",        # Pixel format with alpha support
-            "-auto-alt-ref", "0",          # Disable alternate reference frames (needed for transparency)
-            output_path
-        ], check=True, capture_output=True, text=True)
+        with encoder.encoder_slot() as settings:
+            result = subprocess.run([
+                ffmpeg_exe(), "-y",  # Overwrite output if it exists
+                "-i", input_path,
+                "-c:v", "libvpx-vp9",          # Use VP9 codec
+                "-pix_fmt", "yuva420p",        # Pixel format with alpha support
+                "-auto-alt-ref", "0",          # Disable alternate reference frames (needed for transparency)
+                "-threads", str(settings["threads"]),
+                "-row-mt", "1",                # Let VP9 use its threads within a frame
+                output_path
+            ], check=True, capture_output=True, text=True)
 
         print(f"[DEBUG] ffmpeg stdout:\n{result.stdout}")
         print(f"[DEBUG] ffmpeg stderr:\n{result.stderr}")
@@ -40,20 +53,22 @@ def convert_mov_to_webm(input_path: str) -> str:
     return output_path
 
 
-def convert_mov_to_mp4(input_path: str) -> str:
-    output_path = input_path.replace(".mov", ".mp4")
+def convert_mov_to_mp4(input_path: str, output_path: str = None) -> str:
+    output_path = output_path or input_path.replace(".mov", ".mp4")
     print(f"[DEBUG] Starting conversion from MOV to MP4")
     print(f"[DEBUG] Input path: {input_path}")
     print(f"[DEBUG] Output path: {output_path}")
 
     try:
-        result = subprocess.run([
-            "ffmpeg", "-y",  # Overwrite output if it exists
-            "-i", input_path,
-            "-vcodec", "libx264",
-            "-acodec", "aac",
-            output_path
-        ], check=True, capture_output=True, text=True)
+        with encoder.encoder_slot() as settings:
+            result = subprocess.run([
+                ffmpeg_exe(), "-y",  # Overwrite output if it exists
+                "-i", input_path,
+                "-vcodec", "libx264",
+                *encoder.x264_args(settings),
+                "-acodec", "aac",
+                output_path
+            ], check=True, capture_output=True, text=True)
 
         print(f"[DEBUG] ffmpeg stdout:\n{result.stdout}")
         print(f"[DEBUG] ffmpeg stderr:\n{result.stderr}")
@@ -68,113 +83,141 @@ def convert_mov_to_mp4(input_path: str) -> str:
     return output_path
 
 
-def remove_background_from_supabase_url(image_url: str) -> str:
-    print(f"Removing background from image URL: {image_url}")  # Debug print
-    response = requests.get(image_url)
-    response.raise_for_status()
+def _push_image_background_removal(image_url: str):
+    bgr_fn = sieve.function.get("sieve/background-removal")
+    # Sieve fetches the image itself, so the input is never copied through this process
+    input_image = sieve.File(url=image_url)
+    return bgr_fn.push(input_file=input_image, background_color_rgb="-1")
 
-    with NamedTemporaryFile(delete=False, suffix=".png") as input_tmp:
-        input_tmp.write(response.content)
-        input_path = input_tmp.name
-        print(f"Temporary input file created: {input_path}")  # Debug print
 
+def _upload_background_removed_image(output_file) -> str:
+    output_path = output_file.path
     try:
-        bgr_fn = sieve.function.get("sieve/background-removal")
-        input_image = sieve.File(path=input_path)
-        output_file = next(bgr_fn.run(input_file=input_image, background_color_rgb= "-1"))
-
-        # Copy Sieve's output to a properly named .png temp file
-        with NamedTemporaryFile(delete=False, suffix=".png") as final_output:
-            shutil.copy(output_file.path, final_output.name)
-            final_output_path = final_output.name
-            print(f"Final output file created: {final_output_path}")  # Debug print
+        # Streams from Sieve's downloaded file; content addressing skips images already stored
+        return upload_to_supabase(output_path, content_type="image/png")
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+            print(f"Removed output file: {output_path}")  # Debug print
 
-        # Upload to Supabase
-        public_url = upload_to_supabase(final_output_path)
-        return public_url
 
-    finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
-            print(f"Removed temporary input file: {input_path}")  # Debug print
-        if 'output_file' in locals() and os.path.exists(output_file.path):
-            os.remove(output_file.path)
-            print(f"Removed output file: {output_file.path}")  # Debug print
-        if 'final_output_path' in locals() and os.path.exists(final_output_path):
-            os.remove(final_output_path)
-            print(f"Removed final output file: {final_output_path}")  # Debug print
-
-
-def remove_background_from_video_url(video_url: str) -> str:
+def remove_background_from_supabase_url(image_url: str) -> str:
+    print(f"Removing background from image URL: {image_url}")  # Debug print
+    output = _push_image_background_removal(image_url)
+    output_file = next(iter(wait_sieve(output, model="sieve/background-removal")))
+    return _upload_background_removed_image(output_file)
+
+
+def remove_background_from_urls(image_urls: list[str]) -> list[dict]:
+    if len(image_urls) > MAX_BATCH_IMAGES:
+        raise ValueError(f"At most {MAX_BATCH_IMAGES} images per batch")
+
+    # Up to BATCH_CONCURRENCY Sieve jobs run in parallel; results keep the order of image_urls
+    remaining = deque(image_urls)
+    pushed = deque()
+    results = []
+    while remaining or pushed:
+        while remaining and len(pushed) < BATCH_CONCURRENCY:
+            image_url = remaining.popleft()
+            print(f"Removing background from image URL: {image_url}")  # Debug print
+            try:
+                pushed.append((image_url, _push_image_background_removal(image_url), None))
+            except Exception as e:
+                pushed.append((image_url, None, e))
+
+        image_url, output, error = pushed.popleft()
+        if error is None:
+            try:
+                output_file = next(iter(wait_sieve(output, model="sieve/background-removal")))
+                results.append({
+                    "image_url": image_url,
+                    "background_removed_url": _upload_background_removed_image(output_file)
+                })
+                continue
+            except Exception as e:
+                error = e
+        print(f"Background removal failed for {image_url}: {error}")
+        results.append({"image_url": image_url, "error": str(error)})
+
+    return results
+
+
+def remove_background_from_video_url(video_url: str, cancel_event=None) -> str:
     print(f"Removing background from video URL: {video_url}")  # Debug print
-    response = requests.get(video_url)
-    response.raise_for_status()
-
-    with NamedTemporaryFile(delete=False, suffix=".mp4") as input_tmp:
-        input_tmp.write(response.content)
-        input_path = input_tmp.name
+    with job_workspace("video-bg") as workspace:
+        with requests.get(video_url, stream=True) as response:
+            response.raise_for_status()
+            input_path = workspace.write_chunks("avatar.mp4", response.iter_content(chunk_size=1024 * 1024))
         print(f"Temporary input file created: {input_path}")  # Debug print
 
-    try:
-        # Initialize the Sieve background removal function
-        background_removal = sieve.function.get("sieve/background-removal")
-
-        # Prepare the input file for Sieve
-        input_file = sieve.File(path=input_path)
-
-        # Set parameters for background removal
-        backend = "parallax"
-        background_color_rgb = "-1"  # Transparent background
-        background_media = sieve.File(url="")  # Optional: provide a background media URL
-        output_type = "masked_frame"
-        video_output_format = "mp4"
-        yield_output_batches = False
-        start_frame = 0
-        end_frame = -1
-        # vanish_allow_scene_splitting = True
-
-        # Run the background removal process
-        output = background_removal.push(
-            input_file,
-            backend,
-            background_color_rgb,
-            background_media,
-            output_type,
-            video_output_format,
-            yield_output_batches,
-            start_frame,
-            end_frame
-            # vanish_allow_scene_splitting
-        )
-
-        print('Processing video in the background...')
-
-        for output_object in output.result():
-            print(output_object, output_object.path)
-            processed_video_path = output_object.path
-            print(f"Processed video saved at: {processed_video_path}")
-            
-            size_mb = os.path.getsize(processed_video_path) / 1024 / 1024
-            print(f"[DEBUG] Final video file size: {size_mb:.2f} MB")
-
-            # Convert if it's .mov
-            if processed_video_path.lower().endswith(".mov"):
-                print(f"Video is .mov file format")
-                processed_video_path = convert_mov_to_webm(processed_video_path)
-
-            print(f"Ready to upload...")
-            public_url = upload_to_supabase(processed_video_path, content_type="video/webm")
-            print(f"Uploaded processed video to Supabase: {public_url}")
-            return public_url
-        
-    except Exception as e:
-        print("Error:", e)
-
-    # finally:
-    #     # Clean up temporary files
-    #     if os.path.exists(input_path):
-    #         os.remove(input_path)
-    #         print(f"Removed temporary input file: {input_path}")  # Debug print
+        sieve_outputs = []
+        try:
+            # Initialize the Sieve background removal function
+            background_removal = sieve.function.get("sieve/background-removal")
+
+            # Prepare the input file for Sieve
+            input_file = sieve.File(path=input_path)
+
+            # Set parameters for background removal
+            backend = "parallax"
+            background_color_rgb = "-1"  # Transparent background
+            background_media = sieve.File(url="")  # Optional: provide a background media URL
+            output_type = "masked_frame"
+            video_output_format = "mp4"
+            yield_output_batches = False
+            start_frame = 0
+            end_frame = -1
+            # vanish_allow_scene_splitting = True
+
+            # Run the background removal process
+            output = background_removal.push(
+                input_file,
+                backend,
+                background_color_rgb,
+                background_media,
+                output_type,
+                video_output_format,
+                yield_output_batches,
+                start_frame,
+                end_frame
+                # vanish_allow_scene_splitting
+            )
+
+            print('Processing video in the background...')
+
+            # Setting cancel_event cancels the Sieve job and aborts here
+            for output_object in wait_sieve(output, cancel_event, model="sieve/background-removal-video"):
+                print(output_object, output_object.path)
+                processed_video_path = output_object.path
+                sieve_outputs.append(processed_video_path)
+                print(f"Processed video saved at: {processed_video_path}")
+
+                size_mb = os.path.getsize(processed_video_path) / 1024 / 1024
+                print(f"[DEBUG] Final video file size: {size_mb:.2f} MB")
+
+                # Convert if it's .mov
+                if processed_video_path.lower().endswith(".mov"):
+                    print(f"Video is .mov file format")
+                    processed_video_path = convert_mov_to_webm(
+                        processed_video_path,
+                        workspace.path_for("avatar_background_removed.webm")
+                    )
+                    workspace.check_quota()
+
+                print(f"Ready to upload...")
+                public_url = upload_to_supabase(processed_video_path, content_type="video/webm")
+                print(f"Uploaded processed video to Supabase: {public_url}")
+                return public_url
+
+            raise RuntimeError(f"Sieve returned no video for {video_url}")
+
+        finally:
+            # Errors and ClientDisconnected still reach the caller; Sieve downloads its outputs
+            # outside the workspace, so they are removed here either way
+            for path in sieve_outputs:
+                if os.path.exists(path):
+                    os.remove(path)
+                    print(f"Removed Sieve output file: {path}")  # Debug print
 
 
 if __name__ == "__main__":
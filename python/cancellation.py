@@ -0,0 +1,153 @@
+import asyncio
+import os
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+import provider_status
+
+# Load environment variables
+load_dotenv()
+
+SIEVE_API_KEY = os.getenv("SIEVE_API_KEY")
+SIEVE_API_URL = "https://mango.sievedata.com/v2"
+
+# How often handlers check whether the client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "requests_cancelled": {},
+    "upstream_jobs_cancelled": {},
+    # Provider time the cancelled jobs were still expected to take, i.e. what cancelling saved
+    "estimated_seconds_saved": {},
+}
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def record_request_cancelled(endpoint: str):
+    with _metrics_lock:
+        counts = _metrics["requests_cancelled"]
+        counts[endpoint] = counts.get(endpoint, 0) + 1
+
+
+def record_upstream_cancelled(provider: str, estimated_completion_at: float = None):
+    # provider is e.g. "fal", "sieve" or "kling_queue" (never submitted at all);
+    # estimated_completion_at comes from provider_status, None when the job was not tracked
+    remaining = max(0.0, estimated_completion_at - time.time()) if estimated_completion_at else 0.0
+    with _metrics_lock:
+        counts = _metrics["upstream_jobs_cancelled"]
+        counts[provider] = counts.get(provider, 0) + 1
+        saved = _metrics["estimated_seconds_saved"]
+        saved[provider] = saved.get(provider, 0.0) + remaining
+
+
+def metrics() -> dict:
+    with _metrics_lock:
+        return {
+            "requests_cancelled": dict(_metrics["requests_cancelled"]),
+            "upstream_jobs_cancelled": dict(_metrics["upstream_jobs_cancelled"]),
+            "estimated_seconds_saved": {
+                provider: round(seconds, 1) for provider, seconds in _metrics["estimated_seconds_saved"].items()
+            },
+        }
+
+
+def sieve_job_id(output) -> str | None:
+    job = getattr(output, "job", None)
+    if isinstance(job, dict):
+        return job.get("id")
+    return getattr(job, "id", None)
+
+
+def cancel_sieve_job(output, estimated_completion_at: float = None):
+    job_id = sieve_job_id(output)
+    if not job_id:
+        print("Could not determine Sieve job id to cancel")
+        return
+
+    try:
+        response = requests.post(
+            f"{SIEVE_API_URL}/jobs/{job_id}/cancel",
+            headers={"X-API-Key": SIEVE_API_KEY},
+            timeout=10,
+        )
+        response.raise_for_status()
+        record_upstream_cancelled("sieve", estimated_completion_at)
+        print(f"Cancelled Sieve job {job_id}")
+    except requests.RequestException as e:
+        print(f"Failed to cancel Sieve job {job_id}: {e}")
+
+
+def _track_sieve(output, model: str) -> str:
+    # Sieve's own result thread already waits on the API; polling done() is local
+    job_id = sieve_job_id(output) or f"sieve-{id(output)}"
+    provider_status.track(job_id, "sieve", model)
+    provider_status.update(job_id, "IN_PROGRESS")
+    return job_id
+
+
+async def await_sieve(output, model: str = "sieve"):
+    # Waits for a pushed Sieve job without pinning it if the awaiting task is cancelled,
+    # and without tying up an executor thread for the whole run
+    loop = asyncio.get_running_loop()
+    job_id = _track_sieve(output, model)
+    try:
+        while not output.done():
+            await asyncio.sleep(provider_status.next_poll_interval(job_id))
+        result = output.result()
+    except asyncio.CancelledError:
+        tracked = provider_status.finish(job_id, succeeded=False)
+        estimate = tracked["estimated_completion_at"] if tracked else None
+        await loop.run_in_executor(None, cancel_sieve_job, output, estimate)
+        raise
+    except Exception:
+        provider_status.finish(job_id, succeeded=False)
+        raise
+    provider_status.finish(job_id)
+    return result
+
+
+def wait_sieve(output, cancel_event: threading.Event = None, poll_seconds: float = 1.0, model: str = "sieve"):
+    # Blocking variant for code running in worker threads
+    job_id = _track_sieve(output, model)
+    try:
+        while not output.done():
+            if cancel_event is not None and cancel_event.is_set():
+                tracked = provider_status.finish(job_id, succeeded=False)
+                cancel_sieve_job(output, tracked["estimated_completion_at"] if tracked else None)
+                raise ClientDisconnected("Sieve job cancelled")
+            interval = provider_status.next_poll_interval(job_id)
+            if cancel_event is not None:
+                # Cancellation is still noticed within poll_seconds
+                interval = min(interval, poll_seconds)
+            time.sleep(interval)
+        result = output.result()
+    except Exception:
+        provider_status.finish(job_id, succeeded=False)
+        raise
+    provider_status.finish(job_id)
+    return result
+
+
+async def run_until_disconnect(http_request, coro, endpoint: str):
+    # Runs the handler's work as a task and cancels it if the client goes away
+    task = asyncio.ensure_future(coro)
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+
+        if await http_request.is_disconnected():
+            print(f"Client disconnected from {endpoint}, cancelling upstream work")
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            record_request_cancelled(endpoint)
+            raise ClientDisconnected(f"Client disconnected from {endpoint}")
@@ -0,0 +1,100 @@
+import json
+import time
+import uuid
+from contextlib import closing
+from local_db import connect
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS adventures (
+                id TEXT PRIMARY KEY,
+                inputs TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS adventure_stages (
+                adventure_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                inputs TEXT NOT NULL,
+                output TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (adventure_id, stage)
+            );
+        """)
+    _schema_ready = True
+
+
+def create_adventure(inputs: dict) -> str:
+    _ensure_schema()
+    adventure_id = str(uuid.uuid4())
+    now = time.time()
+
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO adventures (id, inputs, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (adventure_id, json.dumps(inputs), "queued", now, now),
+        )
+    return adventure_id
+
+
+def set_adventure_status(adventure_id: str, status: str, error: str = None):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute(
+            "UPDATE adventures SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), adventure_id),
+        )
+
+
+def get_adventure(adventure_id: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM adventures WHERE id = ?", (adventure_id,)).fetchone()
+        if row is None:
+            return None
+        stage_rows = conn.execute(
+            "SELECT stage, output, updated_at FROM adventure_stages WHERE adventure_id = ? ORDER BY updated_at",
+            (adventure_id,),
+        ).fetchall()
+
+    return {
+        "id": row["id"],
+        "inputs": json.loads(row["inputs"]),
+        "status": row["status"],
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "stages": {stage["stage"]: json.loads(stage["output"]) for stage in stage_rows},
+    }
+
+
+def get_stage(adventure_id: str, stage: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT inputs, output FROM adventure_stages WHERE adventure_id = ? AND stage = ?",
+            (adventure_id, stage),
+        ).fetchone()
+
+    if row is None:
+        return None
+    return {"inputs": json.loads(row["inputs"]), "output": json.loads(row["output"])}
+
+
+def save_stage(adventure_id: str, stage: str, inputs: dict, output):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO adventure_stages (adventure_id, stage, inputs, output, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (adventure_id, stage, json.dumps(inputs), json.dumps(output), time.time()),
+        )
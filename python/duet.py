@@ -0,0 +1,102 @@
+import asyncio
+import time
+import uuid
+from contextlib import closing
+import job_queue
+from fal_kling_duet import generate_kling_duet_video
+from kling_scheduler import scheduler as kling_scheduler
+from local_db import connect
+from supabase_utils import rehost_url_to_supabase
+
+# How often a waiting duet reports its status to the client
+STATUS_INTERVAL_SECONDS = 5
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS background_removal_cache (
+                image_url TEXT PRIMARY KEY,
+                background_removed_url TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+    _schema_ready = True
+
+
+async def cached_background_removal(image_url: str) -> str:
+    # The same pet photo is reused across many duets, so its cut-out is only made once
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT background_removed_url FROM background_removal_cache WHERE image_url = ?", (image_url,)
+        ).fetchone()
+    if row:
+        return row["background_removed_url"]
+
+    result = await job_queue.run_job("remove_background_image", {"image_url": image_url})
+    background_removed_url = result["background_removed_url"]
+
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO background_removal_cache (image_url, background_removed_url, created_at) VALUES (?, ?, ?)",
+            (image_url, background_removed_url, time.time()),
+        )
+    return background_removed_url
+
+
+async def run_duet(prompt: str, image_url_1: str, image_url_2: str, user_id: str, priority: str = "interactive",
+                   storage_folder: str = None):
+    # Async generator of status events; the last one has the re-hosted video URL.
+    # storage_folder is the signed-in user's id; anonymous duets get a random folder, never the caller's address.
+    yield {"stage": "background_removal", "status": "running"}
+    pet_url_1, pet_url_2 = await asyncio.gather(
+        cached_background_removal(image_url_1),
+        cached_background_removal(image_url_2),
+    )
+    background_removed_urls = [pet_url_1, pet_url_2]
+    yield {"stage": "background_removal", "status": "completed", "background_removed_urls": background_removed_urls}
+
+    tickets = []
+    duet_task = asyncio.create_task(
+        generate_kling_duet_video(prompt, pet_url_1, pet_url_2, user_id=user_id, priority=priority, on_ticket=tickets.append)
+    )
+    try:
+        while True:
+            done, _ = await asyncio.wait({duet_task}, timeout=STATUS_INTERVAL_SECONDS)
+            if done:
+                break
+            # This duet's own ticket, not whichever of the user's jobs is first in line
+            position = kling_scheduler.queue_position(tickets[0]) if tickets else None
+            yield {
+                "stage": "kling",
+                "status": "queued" if position else "running",
+                "queue_position": position,
+            }
+    finally:
+        # Client gone or generator closed early: stop the Kling job as well
+        if not duet_task.done():
+            duet_task.cancel()
+
+    result = duet_task.result()
+    yield {"stage": "kling", "status": "completed"}
+
+    yield {"stage": "rehost", "status": "running"}
+    folder = storage_folder or f"anonymous/{uuid.uuid4().hex}"
+    storage_path = f"{folder}/duet_{int(time.time() * 1000)}.mp4"
+    loop = asyncio.get_running_loop()
+    video_url = await loop.run_in_executor(None, rehost_url_to_supabase, result["video"]["url"], "video/mp4", storage_path)
+
+    yield {
+        "stage": "completed",
+        "status": "completed",
+        "video_url": video_url,
+        "background_removed_urls": background_removed_urls,
+        "result": result,
+    }
@@ -0,0 +1,142 @@
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from ffmpeg_tools import ffmpeg_exe
+
+# Encoder threads are shared out across concurrent encodes on this node
+CPU_COUNT = os.cpu_count() or 1
+# x264 presets from fastest to slowest
+PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+# Rough 720p throughput of each preset relative to veryfast
+PRESET_SPEED = {"ultrafast": 3.0, "superfast": 2.0, "veryfast": 1.0, "faster": 0.7, "fast": 0.5, "medium": 0.4}
+DEFAULT_PRESET = "veryfast"
+DEFAULT_CRF = 23
+
+# Threads are sized for at least this many encodes at once, or the recent peak if higher
+EXPECTED_CONCURRENT_ENCODES = int(os.getenv("EXPECTED_CONCURRENT_ENCODES", "2"))
+PEAK_WINDOW_SECONDS = 600
+# Each encode gets the slowest (best compressing) preset that still reaches this speed
+TARGET_ENCODE_FPS = float(os.getenv("TARGET_ENCODE_FPS", "60"))
+
+CALIBRATION_SIZE = "1280x720"
+CALIBRATION_FRAMES = 60
+
+_lock = threading.Lock()
+# Notified whenever an encode gives its threads back
+_threads_freed = threading.Condition(_lock)
+_threads_in_use = 0
+_in_flight = 0
+_waiting = 0
+_completed = 0
+_peak_in_flight = 0
+_peak_at = 0.0
+_calibration = None
+
+
+def calibrate() -> dict:
+    # Single-threaded veryfast encode of a synthetic 720p clip to gauge node speed
+    global _calibration
+    command = [
+        ffmpeg_exe(), "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={CALIBRATION_SIZE}:rate=30",
+        "-frames:v", str(CALIBRATION_FRAMES),
+        "-c:v", "libx264", "-preset", DEFAULT_PRESET, "-threads", "1",
+        "-f", "null", "-",
+    ]
+
+    try:
+        started = time.monotonic()
+        subprocess.run(command, check=True, capture_output=True)
+        fps = CALIBRATION_FRAMES / (time.monotonic() - started)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[encoder] Calibration failed, using defaults: {e}")
+        _calibration = {"fps_per_thread": None}
+        return _calibration
+
+    _calibration = {"fps_per_thread": round(fps, 1)}
+    print(f"[encoder] Calibrated: {_calibration}")
+    return _calibration
+
+
+def calibrate_in_background():
+    threading.Thread(target=calibrate, name="encoder-calibration", daemon=True).start()
+
+
+def _expected_concurrency(now: float) -> int:
+    # Called with _lock held; encodes waiting for threads count as demand too.
+    # The peak decays once the window passes without reaching it again
+    global _peak_in_flight, _peak_at
+    demand = _in_flight + _waiting
+    if demand >= _peak_in_flight or now - _peak_at > PEAK_WINDOW_SECONDS:
+        _peak_in_flight, _peak_at = demand, now
+    return max(EXPECTED_CONCURRENT_ENCODES, _peak_in_flight)
+
+
+def _choose_preset(threads: int) -> str:
+    fps_per_thread = _calibration["fps_per_thread"] if _calibration else None
+    if not fps_per_thread:
+        return DEFAULT_PRESET
+    # Assumes x264 scales about linearly with threads at these counts
+    for preset in reversed(PRESETS):
+        if fps_per_thread * threads * PRESET_SPEED[preset] / PRESET_SPEED[DEFAULT_PRESET] >= TARGET_ENCODE_FPS:
+            return preset
+    return PRESETS[0]
+
+
+@contextmanager
+def encoder_slot():
+    # Threads come from the expected concurrency, capped so all encodes together never use more than
+    # CPU_COUNT; when every core is taken the encode waits for one to be given back
+    global _threads_in_use, _in_flight, _completed, _waiting
+
+    with _lock:
+        _waiting += 1
+        try:
+            while CPU_COUNT - _threads_in_use < 1:
+                _threads_freed.wait()
+        finally:
+            _waiting -= 1
+        threads = min(max(1, CPU_COUNT // _expected_concurrency(time.time())), CPU_COUNT - _threads_in_use)
+        _in_flight += 1
+        _threads_in_use += threads
+    settings = {"preset": _choose_preset(threads), "threads": threads, "crf": DEFAULT_CRF}
+
+    print(f"[encoder] Encoding with {settings}")
+    try:
+        yield settings
+    finally:
+        with _lock:
+            _threads_in_use -= threads
+            _in_flight -= 1
+            _completed += 1
+            _threads_freed.notify_all()
+
+
+def x264_args(settings: dict) -> list[str]:
+    return [
+        "-preset", settings["preset"],
+        "-crf", str(settings["crf"]),
+        "-threads", str(settings["threads"]),
+    ]
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "cpu_count": CPU_COUNT,
+            "threads_in_use": _threads_in_use,
+            "in_flight": _in_flight,
+            "waiting": _waiting,
+            "peak_in_flight": _peak_in_flight,
+            "completed": _completed,
+            "calibration": _calibration,
+        }
+
+
+if __name__ == "__main__":
+    print(calibrate())
+    for concurrent in (1, 2, 4, 8):
+        threads = max(1, CPU_COUNT // concurrent)
+        print(concurrent, _choose_preset(threads), threads)
@@ -1,20 +1,25 @@
 import asyncio
-import fal_client
+import fal_jobs
+from kling_scheduler import scheduler, DEFAULT_PRIORITY, KLING_APPLICATION
 import uuid
 
 
-async def generate_kling_video(prompt, image_url_1):
+async def generate_kling_video(prompt, image_url_1, wait: bool = True, user_id: str = "anonymous", priority: str = DEFAULT_PRIORITY):
     try:
-        handler = await fal_client.submit_async(
-            "fal-ai/kling-video/v1.6/standard/elements",
-            arguments={
+        # Shares the global Kling queue with every other user's scenes
+        result = await scheduler.run(
+            user_id,
+            priority,
+            fal_jobs.run,
+            KLING_APPLICATION,
+            {
                 "prompt": prompt,
-                "input_image_urls": [image_url_1]
+                "input_image_urls": [image_url_1, image_url_1]  # Using the same image twice
             },
+            wait=wait,
+            # In webhook mode the job runs on after submission and keeps its slot until it ends
+            hold=None if wait else fal_jobs.wait_until_finished,
         )
-
-        # Get the initial response
-        result = await handler.get()
         return result
 
     except Exception as e:
@@ -31,7 +36,7 @@ async def example_kling_generation():
 
 
 # Stitching function
-async def generate_ffmpeg_comp(scene_urls: list):
+async def generate_ffmpeg_comp(scene_urls: list, wait: bool = True):
     track_id = str(uuid.uuid4())
     keyframes = []
 
@@ -42,21 +47,18 @@ async def generate_ffmpeg_comp(scene_urls: list):
             "url": url
         })
 
-    handler = await fal_client.submit_async(
+    result = await fal_jobs.run(
         "fal-ai/ffmpeg-api/compose",
-        arguments={
+        {
             "tracks": [{
                 "id": track_id,
                 "type": "video",
                 "keyframes": keyframes
             }]
         },
+        wait=wait,
+        stream_logs=True,
     )
-
-    async for event in handler.iter_events(with_logs=True):
-        print(event)
-
-    result = await handler.get()
     print(result)
     return result
 
@@ -0,0 +1,507 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import closing
+import requests
+from dotenv import load_dotenv
+from lazy_imports import lazy_import
+from local_db import connect
+import provider_status
+from cancellation import record_upstream_cancelled
+
+fal_client = lazy_import("fal_client")
+ed25519 = lazy_import("cryptography.hazmat.primitives.asymmetric.ed25519")
+crypto_exceptions = lazy_import("cryptography.exceptions")
+
+# Load environment variables
+load_dotenv()
+
+# When set, fal jobs are submitted with this webhook and nothing is held open while they run
+FAL_WEBHOOK_URL = os.getenv("FAL_WEBHOOK_URL")
+# Optional shared secret expected as ?token=... on incoming webhook calls
+FAL_WEBHOOK_TOKEN = os.getenv("FAL_WEBHOOK_TOKEN")
+# fal signs every webhook; only turn this off for local tests with send_test_webhook
+FAL_WEBHOOK_VERIFY_SIGNATURE = os.getenv("FAL_WEBHOOK_VERIFY_SIGNATURE", "true").lower() != "false"
+FAL_JWKS_URL = "https://rest.alpha.fal.ai/.well-known/jwks.json"
+JWKS_CACHE_SECONDS = 24 * 3600
+# Webhooks signed further than this from our clock are rejected as replays
+WEBHOOK_TIMESTAMP_TOLERANCE_SECONDS = 300
+# A waiting caller gives up and cancels the fal job after this long
+FAL_JOB_TIMEOUT_SECONDS = float(os.getenv("FAL_JOB_TIMEOUT_SECONDS", "1800"))
+# How long after fal reports a job done its webhook may take before the result is fetched directly
+WEBHOOK_GRACE_SECONDS = float(os.getenv("FAL_WEBHOOK_GRACE_SECONDS", "30"))
+# A delivery not renewed for this long is presumed dead with its process and is redelivered
+CLAIM_LEASE_SECONDS = float(os.getenv("FAL_CLAIM_LEASE_SECONDS", "120"))
+# Post-processing steps that run once a webhook delivers a job's payload
+_follow_ups = {}
+# request_id -> when fal first reported the job completed while its webhook was still missing
+_completed_seen = {}
+# Running follow-up tasks; the event loop only keeps weak references to tasks
+_follow_up_tasks = set()
+_jwks = None
+_jwks_fetched_at = 0.0
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS fal_jobs (
+                request_id TEXT PRIMARY KEY,
+                application TEXT,
+                status TEXT NOT NULL,
+                follow_up TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                completed_at REAL,
+                claimed_at REAL
+            )
+        """)
+        # Tables created before deliveries were leased lack this column
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(fal_jobs)")}
+        if "claimed_at" not in columns:
+            conn.execute("ALTER TABLE fal_jobs ADD COLUMN claimed_at REAL")
+    _schema_ready = True
+
+
+def webhook_mode_enabled() -> bool:
+    return bool(FAL_WEBHOOK_URL)
+
+
+def register_follow_up(name: str, fn):
+    # fn(payload, cancel_event) returns the job's final result and stops early once cancel_event is set
+    _follow_ups[name] = fn
+
+
+def _webhook_url() -> str:
+    if not FAL_WEBHOOK_TOKEN:
+        return FAL_WEBHOOK_URL
+    separator = "&" if "?" in FAL_WEBHOOK_URL else "?"
+    return f"{FAL_WEBHOOK_URL}{separator}token={FAL_WEBHOOK_TOKEN}"
+
+
+def _fal_public_keys() -> list:
+    global _jwks, _jwks_fetched_at
+    if _jwks is None or time.time() - _jwks_fetched_at > JWKS_CACHE_SECONDS:
+        response = requests.get(FAL_JWKS_URL, timeout=10)
+        response.raise_for_status()
+        _jwks = [
+            ed25519.Ed25519PublicKey.from_public_bytes(base64.urlsafe_b64decode(key["x"] + "=="))
+            for key in response.json().get("keys", [])
+        ]
+        _jwks_fetched_at = time.time()
+    return _jwks
+
+
+def verify_webhook_signature(headers, body: bytes) -> bool:
+    # fal signs "request id\nuser id\ntimestamp\nsha256(body)" with ED25519
+    if not FAL_WEBHOOK_VERIFY_SIGNATURE:
+        return True
+
+    request_id = headers.get("x-fal-webhook-request-id")
+    user_id = headers.get("x-fal-webhook-user-id")
+    timestamp = headers.get("x-fal-webhook-timestamp")
+    signature = headers.get("x-fal-webhook-signature")
+    if not (request_id and user_id and timestamp and signature):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > WEBHOOK_TIMESTAMP_TOLERANCE_SECONDS:
+            return False
+        signature_bytes = bytes.fromhex(signature)
+    except ValueError:
+        return False
+
+    message = "\n".join([request_id, user_id, timestamp, hashlib.sha256(body).hexdigest()]).encode()
+    for key in _fal_public_keys():
+        try:
+            key.verify(signature_bytes, message)
+            return True
+        except crypto_exceptions.InvalidSignature:
+            continue
+    return False
+
+
+def _row_to_job(row) -> dict:
+    return {
+        "request_id": row["request_id"],
+        "application": row["application"],
+        "status": row["status"],
+        "follow_up": row["follow_up"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "completed_at": row["completed_at"],
+        "claimed_at": row["claimed_at"],
+    }
+
+
+def get_job(request_id: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM fal_jobs WHERE request_id = ?", (request_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def _record_job(request_id: str, application: str, follow_up: str = None):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        # The webhook can race the insert, so never overwrite a completed record
+        conn.execute("""
+            INSERT INTO fal_jobs (request_id, application, status, follow_up, created_at)
+            VALUES (?, ?, 'IN_QUEUE', ?, ?)
+            ON CONFLICT(request_id) DO UPDATE SET application = excluded.application, follow_up = excluded.follow_up
+        """, (request_id, application, follow_up, time.time()))
+
+
+def _finish_job(request_id: str, status: str, result=None, error: str = None):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute("""
+            INSERT INTO fal_jobs (request_id, status, result, error, created_at, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(request_id) DO UPDATE SET
+                status = excluded.status,
+                result = excluded.result,
+                error = excluded.error,
+                completed_at = excluded.completed_at
+        """, (request_id, status, json.dumps(result) if result is not None else None, error, time.time(), time.time()))
+
+
+def _park_unclaimed(request_id: str, payload) -> bool:
+    # A webhook for a job submit() has not recorded yet; submit() delivers it once it does
+    _ensure_schema()
+    with closing(connect()) as conn:
+        cursor = conn.execute("""
+            INSERT INTO fal_jobs (request_id, status, result, created_at)
+            VALUES (?, 'UNCLAIMED', ?, ?)
+            ON CONFLICT(request_id) DO NOTHING
+        """, (request_id, json.dumps(payload), time.time()))
+    return cursor.rowcount == 1
+
+
+def _claim(request_id: str, statuses: tuple, claimed_before: float = None) -> bool:
+    # Webhook, submitter and the missed-webhook fallback all race to deliver a payload; one wins.
+    # With claimed_before, only a delivery whose lease was last renewed before then is taken over
+    _ensure_schema()
+    placeholders = ", ".join("?" for _ in statuses)
+    query = f"UPDATE fal_jobs SET status = 'DELIVERING', claimed_at = ? WHERE request_id = ? AND status IN ({placeholders})"
+    params = [time.time(), request_id, *statuses]
+    if claimed_before is not None:
+        query += " AND COALESCE(claimed_at, 0) < ?"
+        params.append(claimed_before)
+    with closing(connect()) as conn:
+        cursor = conn.execute(query, params)
+    return cursor.rowcount == 1
+
+
+def _renew_claim(request_id: str):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute(
+            "UPDATE fal_jobs SET claimed_at = ? WHERE request_id = ? AND status IN ('DELIVERING', 'POST_PROCESSING')",
+            (time.time(), request_id),
+        )
+
+
+async def _deliver(request_id: str, follow_up: str | None, payload):
+    if not follow_up:
+        _finish_job(request_id, "COMPLETED", result=payload)
+        return
+
+    # Answer the webhook right away and post-process in the background
+    _finish_job(request_id, "POST_PROCESSING")
+    task = asyncio.create_task(_run_follow_up(request_id, follow_up, payload))
+    _follow_up_tasks.add(task)
+    task.add_done_callback(_follow_up_tasks.discard)
+
+
+async def submit(application: str, arguments: dict, follow_up: str = None) -> dict:
+    handler = await fal_client.submit_async(
+        application,
+        arguments=arguments,
+        webhook_url=_webhook_url(),
+    )
+    _record_job(handler.request_id, application, follow_up)
+    print(f"Submitted {application} job {handler.request_id} with webhook")
+
+    if _claim(handler.request_id, ("UNCLAIMED",)):
+        # The webhook beat us to the record and left its payload behind
+        await _deliver(handler.request_id, follow_up, get_job(handler.request_id)["result"])
+    return {"request_id": handler.request_id, "status": "IN_QUEUE"}
+
+
+async def cancel_job(request_id: str):
+    job = get_job(request_id)
+    if job is None or job["status"] in ("COMPLETED", "FAILED", "CANCELLED"):
+        return
+
+    try:
+        await fal_client.cancel_async(job["application"], request_id)
+        record_upstream_cancelled("fal", provider_status.estimate_completion(job["application"], job["created_at"]))
+        print(f"Cancelled fal job {request_id}")
+    except Exception as e:
+        print(f"Failed to cancel fal job {request_id}: {e}")
+    _finish_job(request_id, "CANCELLED")
+
+
+async def _refresh_status(request_id: str, get_status, printed_logs: int = None) -> tuple[bool, int]:
+    # Returns (completed, logs seen so far); passing printed_logs prints the new log lines
+    status = await get_status()
+    if isinstance(status, fal_client.Queued):
+        provider_status.update(request_id, "IN_QUEUE", status.position)
+    elif isinstance(status, fal_client.InProgress):
+        provider_status.update(request_id, "IN_PROGRESS")
+
+    logs = getattr(status, "logs", None) or []
+    if printed_logs is not None:
+        for log in logs[printed_logs:]:
+            print(log)
+    return isinstance(status, fal_client.Completed), len(logs)
+
+
+async def _fetch_missed_result(job: dict, redeliver: bool = False):
+    # redeliver takes over a delivery whose process died after claiming it, once its lease has expired
+    request_id = job["request_id"]
+    if redeliver:
+        claimed = _claim(request_id, ("DELIVERING", "POST_PROCESSING"), time.time() - CLAIM_LEASE_SECONDS)
+    else:
+        claimed = _claim(request_id, ("IN_QUEUE", "IN_PROGRESS"))
+    if not claimed:
+        return
+
+    if redeliver:
+        print(f"Delivery of fal job {request_id} stalled in {job['status']}, fetching the result again")
+    else:
+        print(f"Webhook for fal job {request_id} never arrived, fetching the result directly")
+    try:
+        payload = await fal_client.result_async(job["application"], request_id)
+    except Exception as e:
+        _finish_job(request_id, "FAILED", error=str(e))
+        return
+    if not redeliver:
+        _record_webhook_duration(request_id, job)
+    await _deliver(request_id, job["follow_up"], payload)
+
+
+async def reconcile_job(request_id: str) -> dict | None:
+    # Asks fal about a job still waiting on its webhook; a lost webhook is replaced by fetching the result,
+    # and so is a delivery left behind by a process that died mid-way
+    job = get_job(request_id)
+    if job is None or not job["application"]:
+        return job
+    if job["status"] in ("DELIVERING", "POST_PROCESSING"):
+        if time.time() - (job["claimed_at"] or 0) >= CLAIM_LEASE_SECONDS:
+            await _fetch_missed_result(job, redeliver=True)
+            return get_job(request_id)
+        return job
+    if job["status"] not in ("IN_QUEUE", "IN_PROGRESS"):
+        return job
+
+    try:
+        completed, _ = await _refresh_status(
+            request_id,
+            lambda: fal_client.status_async(job["application"], request_id),
+        )
+    except Exception as e:
+        print(f"Could not fetch status of fal job {request_id}: {e}")
+        return job
+
+    if not completed:
+        return job
+    seen_at = _completed_seen.setdefault(request_id, time.time())
+    if time.time() - seen_at >= WEBHOOK_GRACE_SECONDS:
+        _completed_seen.pop(request_id, None)
+        await _fetch_missed_result(job)
+    return get_job(request_id)
+
+
+async def wait_for_job(request_id: str) -> dict:
+    # The local record is where the webhook lands; fal itself is asked for queue position and, if the
+    # webhook goes missing, for the result
+    job = get_job(request_id)
+    if job and job["status"] not in ("COMPLETED", "FAILED", "CANCELLED"):
+        provider_status.track(request_id, "fal", job["application"], submitted_at=job["created_at"])
+    deadline = (job["created_at"] if job else time.time()) + FAL_JOB_TIMEOUT_SECONDS
+
+    try:
+        while True:
+            job = await reconcile_job(request_id)
+            if job and job["status"] == "COMPLETED":
+                return job["result"]
+            if job and job["status"] in ("FAILED", "CANCELLED"):
+                raise Exception(f"fal job {request_id} failed: {job['error'] or job['status']}")
+
+            if time.time() >= deadline:
+                await cancel_job(request_id)
+                raise TimeoutError(f"fal job {request_id} did not finish within {FAL_JOB_TIMEOUT_SECONDS:.0f}s")
+            await asyncio.sleep(provider_status.next_poll_interval(request_id))
+    except asyncio.CancelledError:
+        await cancel_job(request_id)
+        raise
+    finally:
+        _completed_seen.pop(request_id, None)
+        # handle_webhook already recorded the duration
+        provider_status.finish(request_id, succeeded=False)
+
+
+async def wait_until_finished(job: dict):
+    # For a job submitted without waiting: returns once it has ended, however it ended.
+    # Unlike wait_for_job, being cancelled or giving up leaves the fal job running.
+    if not isinstance(job, dict) or "request_id" not in job:
+        return
+
+    request_id = job["request_id"]
+    job = get_job(request_id)
+    if job is None:
+        return
+    provider_status.track(request_id, "fal", job["application"], submitted_at=job["created_at"])
+    deadline = job["created_at"] + FAL_JOB_TIMEOUT_SECONDS
+    try:
+        while time.time() < deadline:
+            job = await reconcile_job(request_id)
+            if job is None or job["status"] in ("COMPLETED", "FAILED", "CANCELLED"):
+                return
+            await asyncio.sleep(provider_status.next_poll_interval(request_id))
+    finally:
+        _completed_seen.pop(request_id, None)
+        provider_status.finish(request_id, succeeded=False)
+
+
+async def _run_follow_up_in_executor(follow_up: str, payload: dict):
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    try:
+        return await loop.run_in_executor(None, _follow_ups[follow_up], payload, cancel_event)
+    except asyncio.CancelledError:
+        # The worker thread notices the event and cancels its own upstream job
+        cancel_event.set()
+        raise
+
+
+async def run(application: str, arguments: dict, wait: bool = True, stream_logs: bool = False, follow_up: str = None) -> dict:
+    if webhook_mode_enabled():
+        job = await submit(application, arguments, follow_up)
+        if not wait:
+            return job
+        return await wait_for_job(job["request_id"])
+
+    handler = await fal_client.submit_async(application, arguments=arguments)
+    provider_status.track(handler.request_id, "fal", application)
+
+    try:
+        # Polled on a schedule from the model's duration history instead of holding a stream open
+        printed_logs = 0 if stream_logs else None
+        while True:
+            completed, logs_seen = await _refresh_status(
+                handler.request_id,
+                lambda: handler.status(with_logs=stream_logs),
+                printed_logs,
+            )
+            if completed:
+                break
+            if stream_logs:
+                printed_logs = logs_seen
+            await asyncio.sleep(provider_status.next_poll_interval(handler.request_id))
+
+        result = await handler.get()
+    except asyncio.CancelledError:
+        tracked = provider_status.finish(handler.request_id, succeeded=False)
+        # Stop the fal job too, not just our wait on it
+        try:
+            await handler.cancel()
+            record_upstream_cancelled("fal", tracked["estimated_completion_at"] if tracked else None)
+            print(f"Cancelled fal job {handler.request_id}")
+        except Exception as e:
+            print(f"Failed to cancel fal job {handler.request_id}: {e}")
+        raise
+    except Exception:
+        provider_status.finish(handler.request_id, succeeded=False)
+        raise
+    provider_status.finish(handler.request_id)
+
+    if follow_up:
+        result = await _run_follow_up_in_executor(follow_up, result)
+    return result
+
+
+def _record_webhook_duration(request_id: str, job: dict | None):
+    # Jobs nobody is waiting on still feed the duration history
+    if provider_status.finish(request_id) is None and job and job["application"]:
+        provider_status.record_duration(job["application"], time.time() - job["created_at"])
+
+
+async def handle_webhook(body: dict):
+    # fal sends {"request_id", "gateway_request_id", "status": "OK" | "ERROR", "payload", "error"}
+    request_id = body.get("request_id") or body.get("gateway_request_id")
+    if not request_id:
+        raise ValueError("Webhook body has no request_id")
+
+    if body.get("status") != "OK":
+        error = body.get("error") or json.dumps(body.get("payload"))
+        print(f"fal job {request_id} failed: {error}")
+        _finish_job(request_id, "FAILED", error=error)
+        return
+
+    payload = body.get("payload")
+    job = get_job(request_id)
+    if job is None:
+        if _park_unclaimed(request_id, payload):
+            return
+        job = get_job(request_id)
+
+    if not _claim(request_id, ("IN_QUEUE", "IN_PROGRESS")):
+        # Duplicate delivery, or the result was already fetched after a late webhook
+        return
+    _completed_seen.pop(request_id, None)
+    _record_webhook_duration(request_id, job)
+    await _deliver(request_id, job["follow_up"], payload)
+
+
+async def _run_follow_up(request_id: str, follow_up: str, payload: dict):
+    work = asyncio.ensure_future(_run_follow_up_in_executor(follow_up, payload))
+    try:
+        # The lease is renewed while the follow-up runs, so only a dead process's delivery expires
+        while not (await asyncio.wait({work}, timeout=CLAIM_LEASE_SECONDS / 3))[0]:
+            _renew_claim(request_id)
+        result = work.result()
+        _finish_job(request_id, "COMPLETED", result=result)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    except Exception as e:
+        print(f"Follow-up {follow_up} for fal job {request_id} failed: {e}")
+        _finish_job(request_id, "FAILED", error=str(e))
+
+
+def send_test_webhook(webhook_url: str, request_id: str, payload: dict, status: str = "OK", error: str = None):
+    # Local stand-in for fal's webhook sender, for exercising /webhooks/fal without fal
+    body = {
+        "request_id": request_id,
+        "gateway_request_id": request_id,
+        "status": status,
+        "payload": payload,
+    }
+    if error:
+        body["error"] = error
+
+    response = requests.post(webhook_url, json=body)
+    response.raise_for_status()
+    return response.json()
+
+
+if __name__ == "__main__":
+    # Usage: python fal_jobs.py <webhook_url> <request_id> [video_url]
+    url = sys.argv[1]
+    test_request_id = sys.argv[2]
+    video_url = sys.argv[3] if len(sys.argv) > 3 else "https://example.com/video.mp4"
+    print(send_test_webhook(url, test_request_id, {"video": {"url": video_url}}))
@@ -1,25 +1,31 @@
 import asyncio
-import fal_client
+import fal_jobs
+from kling_scheduler import scheduler, DEFAULT_PRIORITY, KLING_APPLICATION
 
-async def generate_kling_duet_video(prompt, image_url_1, image_url_2):
+async def generate_kling_duet_video(prompt, image_url_1, image_url_2, wait: bool = True, user_id: str = "anonymous", priority: str = DEFAULT_PRIORITY, on_ticket=None):
     try:
-        handler = await fal_client.submit_async(
-            "fal-ai/kling-video/v1.6/standard/elements",
-            arguments={
+        # Shares the global Kling queue with every other user's scenes
+        result = await scheduler.run(
+            user_id,
+            priority,
+            fal_jobs.run,
+            KLING_APPLICATION,
+            {
                 "prompt": prompt,
                 "input_image_urls": [image_url_1, image_url_2]
             },
+            wait=wait,
+            # In webhook mode the job runs on after submission and keeps its slot until it ends
+            hold=None if wait else fal_jobs.wait_until_finished,
+            on_ticket=on_ticket,
         )
-
-        # Get the initial response
-        result = await handler.get()
         return result
 
     except Exception as e:
         raise Exception(f"Error generating Kling video: {str(e)}")
     
 if __name__ == "__main__":
-    asyncio.run(generate_kling_video(
+    asyncio.run(generate_kling_duet_video(
         "A cute girl and a baby cow sleeping together on a bed",
         "https://storage.googleapis.com/falserverless/web-examples/kling-elements/first_image.jpeg",
         "https://storage.googleapis.com/falserverless/web-examples/kling-elements/second_image.jpeg"
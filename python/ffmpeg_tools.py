@@ -0,0 +1,18 @@
+import functools
+import shutil
+from lazy_imports import lazy_import
+
+# Bundled with moviepy, so an ffmpeg binary is available even where none is installed
+imageio_ffmpeg = lazy_import("imageio_ffmpeg")
+
+
+@functools.cache
+def ffmpeg_exe() -> str:
+    # The system build when installed (the Docker image has one), else imageio-ffmpeg's static build
+    return shutil.which("ffmpeg") or imageio_ffmpeg.get_ffmpeg_exe()
+
+
+@functools.cache
+def ffprobe_exe() -> str | None:
+    # imageio-ffmpeg ships no ffprobe; callers fall back to parsing ffmpeg's own output
+    return shutil.which("ffprobe")
@@ -1,33 +1,37 @@
 import os
+import subprocess
 import uuid
+from contextlib import ExitStack
 import requests
-import sieve
-from tempfile import NamedTemporaryFile
-from moviepy import VideoFileClip, CompositeVideoClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from moviepy.audio.AudioClip import CompositeAudioClip
-from moviepy.video.fx.Resize import Resize
+import audio_mix
+import encoder
 from supabase_utils import upload_to_supabase
+from workspace import Workspace, job_workspace
+from ffmpeg_tools import ffmpeg_exe
+from render_plans import probe, cached_probe, remember_probe, get_render_plan
+from lazy_imports import lazy_import
 
-TEMP_DIR = "temp_videos"
-os.makedirs(TEMP_DIR, exist_ok=True)
+# Heavy provider and media modules load on first use
+sieve = lazy_import("sieve")
+moviepy = lazy_import("moviepy")
+
+# Inputs at least this long render through one streaming ffmpeg process instead of moviepy.
+# Adventures are four or more 5-second scenes, so every real one streams; moviepy is left for short clips.
+STREAMING_MIN_SECONDS = float(os.getenv("STREAMING_RENDER_MIN_SECONDS", "20"))
 
 
 def get_filename_from_url(url: str) -> str:
     return url.split("/")[-1].split("?")[0]
 
 
-def download_video(url: str, filename: str) -> str:
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to download video from {url}")
-    path = os.path.join(TEMP_DIR, filename)
-    with open(path, "wb") as f:
-        f.write(response.content)
-    return path
+def download_video(url: str, filename: str, workspace: Workspace) -> str:
+    with requests.get(url, stream=True) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download video from {url}")
+        return workspace.write_chunks(filename, response.iter_content(chunk_size=1024 * 1024))
 
 
-def scout_video_search_audio(clip_length: float) -> str:
+def scout_video_search_audio(clip_length: float, workspace: Workspace) -> str:
     query = "instrumental background music with no voiceover"
     print(f"Searching videos on Scout with query: '{query}'")
 
@@ -90,10 +94,15 @@ def scout_video_search_audio(clip_length: float) -> str:
             print(f"Video path: {video_url}")
 
             # Extract audio and save as mp3
-            with VideoFileClip(video_url) as clip:
-                audio_path = video_url.replace(".mp4", ".mp3")
-                clip.audio.write_audiofile(audio_path, logger=None)
-                print(f"Extracted audio saved at: {audio_path}")
+            try:
+                with moviepy.VideoFileClip(video_url) as clip:
+                    audio_path = workspace.path_for(os.path.basename(video_url).replace(".mp4", ".mp3"))
+                    clip.audio.write_audiofile(audio_path, logger=None)
+                    print(f"Extracted audio saved at: {audio_path}")
+            finally:
+                # Only the extracted audio is kept
+                if os.path.exists(video_url):
+                    os.remove(video_url)
 
             return audio_path
 
@@ -102,75 +111,211 @@ def scout_video_search_audio(clip_length: float) -> str:
         return ""
 
 
-def overlay_videos_and_upload(background_url: str, overlay_url: str) -> str:
-    background_filename = get_filename_from_url(background_url)
-    overlay_filename = get_filename_from_url(overlay_url)
-
-    output_filename = f"overlayed_{uuid.uuid4()}.mp4"
-    output_path = os.path.join(TEMP_DIR, output_filename)
-
-    background_path = download_video(background_url, background_filename)
-    overlay_path = download_video(overlay_url, overlay_filename)
-
-    with VideoFileClip(background_path) as background, VideoFileClip(overlay_path, has_mask=True) as overlay_clip:
-        bg_width, bg_height = background.size
-        ov_width, ov_height = overlay_clip.size
-
-        # Max allowable overlay dimensions
-        max_width = bg_width * 0.25
-        max_height = bg_height * 0.5
-
-        # Maintain aspect ratio while fitting within max dimensions
-        aspect_ratio = ov_width / ov_height
-
-        if ov_width / max_width > ov_height / max_height:
-            # Width is the limiting factor
-            target_width = max_width
-            target_height = target_width / aspect_ratio
+def prepare_overlay_inputs(background_url: str, overlay_url: str, workspace: Workspace) -> dict:
+    # Downloaded once and shared by the preview and final renders; the URLs key the probe cache
+    return {
+        "workspace": workspace,
+        "background_url": background_url,
+        "overlay_url": overlay_url,
+        "background_path": download_video(background_url, "background_" + get_filename_from_url(background_url), workspace),
+        "overlay_path": download_video(overlay_url, "overlay_" + get_filename_from_url(overlay_url), workspace),
+        "music_path": None,
+    }
+
+
+def _music_for(inputs: dict, duration: float) -> str:
+    # The Scout search runs once per set of inputs
+    if inputs["music_path"] is None:
+        inputs["music_path"] = scout_video_search_audio(duration, inputs["workspace"])
+    return inputs["music_path"]
+
+
+def render_overlay_streaming(inputs: dict, output_path: str, preview: bool = False) -> str:
+    # ffmpeg decodes, composites and encodes frame by frame and writes the output as it goes,
+    # so memory stays flat however long the inputs are
+    background_info = probe(inputs["background_path"], inputs.get("background_url"))
+    overlay_info = probe(inputs["overlay_path"], inputs.get("overlay_url"))
+    plan = get_render_plan(background_info, overlay_info, preview=preview)
+    duration = background_info["duration"]
+
+    input_args = ["-i", inputs["background_path"]]
+    if inputs["overlay_path"].lower().endswith(".webm"):
+        # The native VP9 decoder drops the alpha channel, libvpx keeps it
+        input_args += ["-c:v", "libvpx-vp9"]
+    input_args += ["-i", inputs["overlay_path"]]
+
+    # The overlay is the narrating avatar; background audio and music duck under it
+    beds = []
+    if background_info["has_audio"]:
+        beds.append(("[0:a]", audio_mix.BACKGROUND_GAIN_DB))
+    narration = "[1:a]" if overlay_info["has_audio"] else None
+
+    # Add background music
+    music_path = _music_for(inputs, duration)
+    if music_path and os.path.exists(music_path):
+        input_args += ["-i", music_path]
+        beds.append(("[2:a]", audio_mix.MUSIC_GAIN_DB))
+
+    command = [ffmpeg_exe(), "-y", "-v", "error", *input_args]
+    filter_graph = plan["filter_graph"]
+    maps = ["-map", "[v]"]
+    # A decode-only pass measures the mix so the render applies one static gain; narration and
+    # beds are padded or trimmed to the background's length
+    level = audio_mix.measure_mix(input_args, narration, beds, duration)
+    audio_graph = audio_mix.mix_graph(narration, beds, level, duration)
+    if audio_graph:
+        filter_graph += f";{audio_graph}"
+        maps += ["-map", "[a]"]
+    command += ["-filter_complex", filter_graph, *maps]
+    if duration:
+        command += ["-t", f"{duration:.3f}"]
+
+    # Preset and thread count depend on how many encodes are already running
+    with encoder.encoder_slot() as settings:
+        if preview:
+            command += [
+                "-c:v", "libx264", "-preset", "ultrafast", "-threads", str(settings["threads"]),
+                "-r", str(plan["fps"]), "-b:v", plan["bitrate"],
+                "-c:a", "aac", "-b:a", "64k",
+            ]
         else:
-            # Height is the limiting factor
-            target_height = max_height
-            target_width = target_height * aspect_ratio
+            command += ["-c:v", "libx264", *encoder.x264_args(settings), "-c:a", "aac"]
+        command.append(output_path)
+
+        print(f"Streaming render of {duration:.1f}s clip")
+        try:
+            # Stopped early if the output outgrows the workspace quota
+            inputs["workspace"].run(command)
+        except subprocess.CalledProcessError as e:
+            print(f"[ERROR] ffmpeg stderr:\n{e.stderr}")
+            raise
+
+    return output_path
+
+
+def _clip_info(clip) -> dict:
+    # What moviepy read when it opened the file, in the shape probe() returns
+    return {
+        "width": clip.w,
+        "height": clip.h,
+        "duration": clip.duration or 0,
+        "has_audio": clip.audio is not None,
+    }
+
+
+def use_streaming_render(duration: float) -> bool:
+    # moviepy keeps frame and mask buffers per clip, which grows with long adventures
+    return duration >= STREAMING_MIN_SECONDS
+
+
+def render_overlay(inputs: dict, output_path: str, preview: bool = False) -> str:
+    # Layout comes from the plan cache; probe results are cached per source URL
+    background_info = cached_probe(inputs.get("background_url"))
+    if background_info and use_streaming_render(background_info["duration"]):
+        return render_overlay_streaming(inputs, output_path, preview=preview)
+
+    with ExitStack() as clips:
+        # Opening a clip probes its file, so moviepy's metadata stands in for a separate ffprobe
+        background = clips.enter_context(moviepy.VideoFileClip(inputs["background_path"]))
+        background_info = remember_probe(inputs.get("background_url"), _clip_info(background))
+        if use_streaming_render(background_info["duration"]):
+            clips.close()
+            return render_overlay_streaming(inputs, output_path, preview=preview)
+        overlay_clip = clips.enter_context(moviepy.VideoFileClip(inputs["overlay_path"], has_mask=True))
+        overlay_info = remember_probe(inputs.get("overlay_url"), _clip_info(overlay_clip))
+
+        plan = get_render_plan(background_info, overlay_info, preview=preview)
+        geometry = plan["overlay"]
+
+        if plan["background_resized"]:
+            background = background.with_effects([
+                moviepy.vfx.Resize((plan["canvas"]["width"], plan["canvas"]["height"]))
+            ])
 
         overlay_resized = overlay_clip.with_effects([
-            Resize((int(target_width), int(target_height)))
+            moviepy.vfx.Resize((geometry["width"], geometry["height"]))
         ])
         overlay = (
             overlay_resized
-            .with_position((
-                int(bg_width - target_width), 
-                int(bg_height - target_height)
-            ))
+            .with_position((geometry["x"], geometry["y"]))
             .with_start(0)
             .with_duration(min(background.duration, overlay_clip.duration))
         )
 
         # Combine visuals
-        final = CompositeVideoClip([background, overlay])
-        print(f"Clip duration: {final.duration}")
-
-        # Collect audio tracks
-        audio_tracks = []
-        if background.audio:
-            audio_tracks.append(background.audio)
-        if overlay.audio:
-            audio_tracks.append(overlay.audio)
+        final = moviepy.CompositeVideoClip([background, overlay])
+        duration = final.duration
+        print(f"Clip duration: {duration}")
 
         # Add background music
-        music_path = scout_video_search_audio(final.duration)
-
+        music_path = _music_for(inputs, duration)
+        beds = []
+        if background.audio:
+            beds.append((inputs["background_path"], audio_mix.BACKGROUND_GAIN_DB))
         if music_path and os.path.exists(music_path):
-            music_audio = AudioFileClip(music_path)
-            audio_tracks.append(music_audio)
+            beds.append((music_path, audio_mix.MUSIC_GAIN_DB))
+        narration_path = inputs["overlay_path"] if overlay_clip.audio else None
+
+        # moviepy only renders the picture; the audio stage mixes from the source files
+        video_path = inputs["workspace"].path_for(f"video_only_{uuid.uuid4()}.mp4")
+
+        # Preset and thread count depend on how many encodes are already running
+        with encoder.encoder_slot() as settings:
+            if preview:
+                final.write_videofile(
+                    video_path,
+                    codec="libx264",
+                    audio=False,
+                    fps=plan["fps"],
+                    preset="ultrafast",
+                    bitrate=plan["bitrate"],
+                    threads=settings["threads"],
+                )
+            else:
+                final.write_videofile(
+                    video_path,
+                    codec="libx264",
+                    audio=False,
+                    preset=settings["preset"],
+                    threads=settings["threads"],
+                    ffmpeg_params=["-crf", str(settings["crf"])],
+                )
 
-        if audio_tracks:
-            print(audio_tracks)
-            final = final.with_audio(CompositeAudioClip(audio_tracks))
+    try:
+        # moviepy cannot be stopped mid-write, so its output is checked once it is done
+        inputs["workspace"].check_quota()
+        audio_mix.mix_audio(
+            output_path,
+            narration_path,
+            beds,
+            video_path=video_path,
+            audio_bitrate="64k" if preview else None,
+            workspace=inputs["workspace"],
+            duration=duration,
+        )
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+    return output_path
 
-        final.write_videofile(output_path, codec="libx264", audio_codec="aac")
 
-    public_url = upload_to_supabase(output_path, content_type="video/mp4")
-    return public_url
+def render_and_upload(inputs: dict, preview: bool = False) -> str:
+    prefix = "preview" if preview else "overlayed"
+    output_path = inputs["workspace"].path_for(f"{prefix}_{uuid.uuid4()}.mp4")
+    try:
+        render_overlay(inputs, output_path, preview=preview)
+        return upload_to_supabase(output_path, content_type="video/mp4")
+    finally:
+        # Inputs stay for the next render, the output is no longer needed
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+
+def overlay_videos_and_upload(background_url: str, overlay_url: str, preview: bool = False) -> str:
+    with job_workspace("overlay") as workspace:
+        inputs = prepare_overlay_inputs(background_url, overlay_url, workspace)
+        return render_and_upload(inputs, preview=preview)
 
 
 # Example usage
@@ -1,12 +1,15 @@
-from google import genai
 import os
+import threading
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from lazy_imports import lazy_import
 
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 
+genai = lazy_import("google.genai")
+
 # Define the response schema using Pydantic
 class PetStoryline(BaseModel):
     scene1: str
@@ -14,8 +17,18 @@ class PetStoryline(BaseModel):
     scene3: str
     scene4: str
 
-# Initialize the Gemini client
-client = genai.Client(api_key=GOOGLE_API_KEY)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # The Gemini client is created on first use rather than at import
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = genai.Client(api_key=GOOGLE_API_KEY)
+    return _client
+
 
 def create_pet_scenes(user_prompt: str):
     try:
@@ -33,7 +46,7 @@ def create_pet_scenes(user_prompt: str):
         )
 
         # Generate the storyline using the model instance from the client
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt,
             config={
@@ -53,7 +66,6 @@ def create_pet_scenes(user_prompt: str):
 def create_pet_script(video_summaries, scenes):
     try:
         model = "gemini-2.0-flash"
-        client = genai.Client(api_key=GOOGLE_API_KEY)
 
         # Combine the summaries into a single prompt for the model
         combined_summaries = "\n".join([f"- {summary}" for summary in video_summaries])
@@ -70,7 +82,7 @@ def create_pet_script(video_summaries, scenes):
 
         # Generate the storyline using the model instance from the client
 
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt,
             config={
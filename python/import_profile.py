@@ -0,0 +1,67 @@
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Usage:
+#   python import_profile.py            import-time report for main.py
+#   python import_profile.py --serve    also time uvicorn start to first response
+TOP_N = 25
+SERVE_PORT = 8765
+
+
+def import_time_report(module: str = "main", top_n: int = TOP_N):
+    # -X importtime writes "import time: self | cumulative | name" lines to stderr
+    started = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    wall_seconds = time.monotonic() - started
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)", line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else "import failed")
+
+    print(f"import {module}: {wall_seconds:.2f}s wall (including interpreter start)")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, depth, name in sorted(rows, reverse=True)[:top_n]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+
+
+def time_to_first_response(timeout: float = 60):
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(SERVE_PORT)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.monotonic() - started < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{SERVE_PORT}/", timeout=1).read()
+                print(f"Time to first response: {time.monotonic() - started:.2f}s")
+                return
+            except OSError:
+                time.sleep(0.05)
+        print(f"No response within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    import_time_report()
+    if "--serve" in sys.argv:
+        time_to_first_response()
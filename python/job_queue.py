@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import closing
+from dotenv import load_dotenv
+from local_db import connect
+import provider_status
+import tasks
+
+# Load environment variables
+load_dotenv()
+
+# "inline" runs tasks in the API process, "queue" hands them to worker.py processes
+RENDER_MODE = os.getenv("RENDER_MODE", "inline")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Running jobs without a heartbeat for this long belong to a dead worker
+STALE_JOB_SECONDS = 120
+# Bearer token remote workers present to the API's /worker/jobs endpoints; unset disables them
+JOB_WORKER_TOKEN = os.getenv("JOB_WORKER_TOKEN")
+MAX_ATTEMPTS = 3
+
+# Lower numbers are claimed first
+INTERACTIVE_PRIORITY = 0
+BACKGROUND_PRIORITY = 10
+
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, created_at);
+        """)
+    _schema_ready = True
+
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def enqueue(kind: str, payload: dict, priority: int = INTERACTIVE_PRIORITY) -> str:
+    if kind not in tasks.TASKS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    _ensure_schema()
+    job_id = str(uuid.uuid4())
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, priority, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, json.dumps(payload), priority, time.time()),
+        )
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def claim(worker_id: str, kinds: list[str] = None) -> dict | None:
+    _ensure_schema()
+    kinds = kinds or list(tasks.TASKS)
+    placeholders = ", ".join("?" for _ in kinds)
+
+    with closing(connect()) as conn:
+        # IMMEDIATE takes the write lock up front so two workers never claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = 'queued' AND kind IN ({placeholders}) "
+                "ORDER BY priority, created_at LIMIT 1",
+                kinds,
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker_id = ?, attempts = attempts + 1, "
+                "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (worker_id, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    job = _row_to_job(row)
+    job.update(status="running", worker_id=worker_id, attempts=job["attempts"] + 1)
+    return job
+
+
+def describe_job(job_id: str) -> dict | None:
+    # Job record plus queue position and estimated completion time
+    job = get_job(job_id)
+    if job is None:
+        return None
+
+    stats = provider_status.duration_stats(_duration_model(job["kind"]))
+    run_seconds = stats["run_median"] if stats else provider_status.DEFAULT_EXPECTED_SECONDS
+    now = time.time()
+
+    if job["status"] == "queued":
+        with closing(connect()) as conn:
+            ahead = conn.execute(
+                "SELECT COUNT(*) AS count FROM jobs WHERE status = 'queued' AND "
+                "(priority < ? OR (priority = ? AND created_at < ?))",
+                (job["priority"], job["priority"], job["created_at"]),
+            ).fetchone()["count"]
+            running = conn.execute("SELECT COUNT(*) AS count FROM jobs WHERE status = 'running'").fetchone()["count"]
+        job["queue_position"] = ahead + 1
+        # Jobs ahead drain about as fast as there are workers busy now
+        job["estimated_completion_at"] = now + (ahead // max(1, running) + 1) * run_seconds
+    elif job["status"] == "running":
+        job["queue_position"] = 0
+        job["estimated_completion_at"] = max(now, job["started_at"] + run_seconds)
+    return job
+
+
+def _owned(worker_id: str | None) -> tuple[str, tuple]:
+    # Once a lost worker's job is requeued, only its new worker may report on it
+    if worker_id is None:
+        return "", ()
+    return " AND status = 'running' AND worker_id = ?", (worker_id,)
+
+
+def _run_handler(handlers: dict, kind: str, payload: dict, *args):
+    handler = handlers.get(kind)
+    if handler is None:
+        return
+    try:
+        handler(payload, *args)
+    except Exception as e:
+        print(f"[job queue] {handler.__name__} failed: {e}")
+
+
+def heartbeat(job_id: str, worker_id: str = None) -> bool:
+    condition, params = _owned(worker_id)
+    with closing(connect()) as conn:
+        cursor = conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id = ?{condition}", (time.time(), job_id, *params))
+    return cursor.rowcount == 1
+
+
+def _duration_model(kind: str) -> str:
+    return f"job:{kind}"
+
+
+def complete(job_id: str, result: dict, worker_id: str = None) -> bool:
+    # Runs where the queue lives, so completion handlers can update API-side state for remote workers
+    finished_at = time.time()
+    condition, params = _owned(worker_id)
+    with closing(connect()) as conn:
+        cursor = conn.execute(
+            f"UPDATE jobs SET status = 'completed', result = ?, finished_at = ? WHERE id = ?{condition}",
+            (json.dumps(result), finished_at, job_id, *params),
+        )
+        row = conn.execute("SELECT kind, payload, created_at, started_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if cursor.rowcount != 1:
+        return False
+
+    _run_handler(tasks.COMPLETION_HANDLERS, row["kind"], json.loads(row["payload"]), result)
+    # Same rolling statistics as provider jobs, so queued jobs get an estimate too
+    provider_status.record_duration(
+        _duration_model(row["kind"]),
+        finished_at - row["created_at"],
+        row["started_at"] - row["created_at"],
+        finished_at - row["started_at"],
+    )
+    return True
+
+
+def fail(job_id: str, error: str, worker_id: str = None) -> bool:
+    condition, params = _owned(worker_id)
+    with closing(connect()) as conn:
+        cursor = conn.execute(
+            f"UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?{condition}",
+            (error, time.time(), job_id, *params),
+        )
+        row = conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if cursor.rowcount != 1:
+        return False
+    _run_handler(tasks.FAILURE_HANDLERS, row["kind"], json.loads(row["payload"]), error)
+    return True
+
+
+def cancel_if_queued(job_id: str) -> bool:
+    with closing(connect()) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+    return cursor.rowcount > 0
+
+
+def requeue_stale_jobs() -> int:
+    _ensure_schema()
+    cutoff = time.time() - STALE_JOB_SECONDS
+    error = "Worker lost too many times"
+    with closing(connect()) as conn:
+        abandoned = conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+            "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ? RETURNING kind, payload",
+            (error, time.time(), cutoff, MAX_ATTEMPTS),
+        ).fetchall()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker_id = NULL WHERE status = 'running' AND heartbeat_at < ?",
+            (cutoff,),
+        )
+    for row in abandoned:
+        _run_handler(tasks.FAILURE_HANDLERS, row["kind"], json.loads(row["payload"]), error)
+    if cursor.rowcount:
+        print(f"[job queue] Requeued {cursor.rowcount} jobs from lost workers")
+    return cursor.rowcount
+
+
+def queue_stats(kinds: list[str] = None) -> dict:
+    # Queued and running jobs by status, optionally only of the given kinds
+    _ensure_schema()
+    query = "SELECT status, COUNT(*) AS count FROM jobs WHERE status IN ('queued', 'running')"
+    params = []
+    if kinds:
+        query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+        params = kinds
+    with closing(connect()) as conn:
+        rows = conn.execute(query + " GROUP BY status", params).fetchall()
+    return {row["status"]: row["count"] for row in rows}
+
+
+async def wait_for_job(job_id: str) -> dict:
+    try:
+        while True:
+            job = get_job(job_id)
+            if job["status"] == "completed":
+                return job["result"]
+            if job["status"] in ("failed", "cancelled"):
+                raise Exception(job["error"] or f"Job {job_id} {job['status']}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+    except asyncio.CancelledError:
+        # Nobody is waiting any more; drop it if no worker has started it
+        cancel_if_queued(job_id)
+        raise
+
+
+async def run_job(kind: str, payload: dict, priority: int = INTERACTIVE_PRIORITY) -> dict:
+    if RENDER_MODE == "queue":
+        return await wait_for_job(enqueue(kind, payload, priority))
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, tasks.TASKS[kind], payload)
@@ -0,0 +1,162 @@
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from dotenv import load_dotenv
+import provider_status
+from cancellation import record_upstream_cancelled
+
+# Load environment variables
+load_dotenv()
+
+# Lower value is served first; bulk/pre-generation only runs when no interactive work waits
+PRIORITY_CLASSES = {"interactive": 0, "bulk": 1}
+DEFAULT_PRIORITY = "interactive"
+
+KLING_MAX_CONCURRENT = int(os.getenv("KLING_MAX_CONCURRENT", "4"))
+
+KLING_APPLICATION = "fal-ai/kling-video/v1.6/standard/elements"
+
+
+class Ticket:
+    def __init__(self, ticket_id: int, user_id: str, priority: str):
+        self.id = ticket_id
+        self.user_id = user_id
+        self.priority = priority
+        self.started = asyncio.get_running_loop().create_future()
+
+
+class KlingScheduler:
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self._ids = itertools.count(1)
+        # priority class -> user -> that user's waiting tickets, users served round-robin
+        self._waiting = {priority: OrderedDict() for priority in PRIORITY_CLASSES}
+        # Background waits holding a slot for jobs that outlive the call that submitted them
+        self._holds = set()
+
+    def _enqueue(self, ticket: Ticket):
+        users = self._waiting[ticket.priority]
+        users.setdefault(ticket.user_id, deque()).append(ticket)
+
+    def _remove(self, ticket: Ticket):
+        users = self._waiting[ticket.priority]
+        tickets = users.get(ticket.user_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del users[ticket.user_id]
+
+    def _next_ticket(self) -> Ticket | None:
+        for priority in sorted(PRIORITY_CLASSES, key=PRIORITY_CLASSES.get):
+            users = self._waiting[priority]
+            if not users:
+                continue
+            user_id, tickets = next(iter(users.items()))
+            ticket = tickets.popleft()
+            # The user goes to the back of the line for their next job
+            del users[user_id]
+            if tickets:
+                users[user_id] = tickets
+            return ticket
+        return None
+
+    def _dispatch(self):
+        while self.running < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            self.running += 1
+            ticket.started.set_result(True)
+
+    def _dispatch_order(self) -> list[Ticket]:
+        # Simulates _next_ticket without changing any state
+        order = []
+        for priority in sorted(PRIORITY_CLASSES, key=PRIORITY_CLASSES.get):
+            lines = [list(tickets) for tickets in self._waiting[priority].values()]
+            while any(lines):
+                for line in lines:
+                    if line:
+                        order.append(line.pop(0))
+        return order
+
+    def _release(self):
+        self.running -= 1
+        self._dispatch()
+
+    async def _release_after(self, holding):
+        try:
+            await holding
+        except Exception as e:
+            print(f"[kling queue] Held job ended with an error: {e}")
+        finally:
+            self._release()
+
+    async def run(self, user_id: str, priority: str, fn, *args, hold=None, on_ticket=None, **kwargs):
+        # hold(result), if given, is awaited in the background and keeps the slot until it returns,
+        # so jobs submitted without waiting still count against the cap while they run upstream.
+        # on_ticket(ticket_id) lets the caller follow this job's own place in the queue.
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        ticket = Ticket(next(self._ids), user_id, priority)
+        if on_ticket is not None:
+            on_ticket(ticket.id)
+        self._enqueue(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.started
+        except asyncio.CancelledError:
+            # Still waiting: drop out of the queue. Already dispatched: give the slot back
+            if ticket.started.done() and not ticket.started.cancelled():
+                self._release()
+            else:
+                self._remove(ticket)
+                # Never submitted, so the whole job is saved
+                record_upstream_cancelled("kling_queue", provider_status.estimate_completion(KLING_APPLICATION, time.time()))
+            raise
+
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+        if hold is None:
+            self._release()
+            return result
+        task = asyncio.create_task(self._release_after(hold(result)))
+        self._holds.add(task)
+        task.add_done_callback(self._holds.discard)
+        return result
+
+    def queue_position(self, ticket_id: int) -> int | None:
+        # None once the ticket has been dispatched
+        for position, ticket in enumerate(self._dispatch_order(), start=1):
+            if ticket.id == ticket_id:
+                return position
+        return None
+
+    def user_queue(self, user_id: str) -> list[dict]:
+        return [
+            {"ticket_id": ticket.id, "priority": ticket.priority, "queue_position": position}
+            for position, ticket in enumerate(self._dispatch_order(), start=1)
+            if ticket.user_id == user_id
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "held_after_submit": len(self._holds),
+            "max_concurrent": self.max_concurrent,
+            "waiting": {
+                priority: sum(len(tickets) for tickets in users.values())
+                for priority, users in self._waiting.items()
+            },
+        }
+
+
+scheduler = KlingScheduler(KLING_MAX_CONCURRENT)
@@ -0,0 +1,61 @@
+import importlib
+import os
+import threading
+import time
+
+# "background" warms provider modules and clients right after startup instead of on first use
+WARM_START = os.getenv("WARM_START", "")
+
+PROVIDER_MODULES = [
+    "fal_client",
+    "sieve",
+    "moviepy",
+    "supabase",
+    "google.genai",
+    "elevenlabs.client",
+]
+
+
+class LazyModule:
+    # Stands in for a module and imports it on first attribute access
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def warm_up(names: list[str] = None, initializers: list = None):
+    # Imports in a daemon thread so the port is bound before the heavy work starts
+    def run():
+        started = time.monotonic()
+        for name in names or PROVIDER_MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"[warm start] Could not import {name}: {e}")
+        for initializer in initializers or []:
+            try:
+                initializer()
+            except Exception as e:
+                print(f"[warm start] Initializer {initializer.__name__} failed: {e}")
+        print(f"[warm start] Providers ready after {time.monotonic() - started:.2f}s")
+
+    threading.Thread(target=run, name="warm-start", daemon=True).start()
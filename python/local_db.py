@@ -0,0 +1,17 @@
+import os
+import sqlite3
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Single SQLite file for all locally persisted server state
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "local_state.db")
+
+
+def connect() -> sqlite3.Connection:
+    # Autocommit mode: callers open explicit transactions when they need them
+    conn = sqlite3.connect(LOCAL_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
@@ -1,17 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import asyncio
-import sieve
+import hmac
+import json
+from contextlib import contextmanager
 import gemini
-import fal_client
+import checkpoints
+import adventure
+import fal_jobs
+import render_queue
+import encoder
+import workspace
+import lazy_imports
+from kling_scheduler import scheduler as kling_scheduler
 from fal import generate_kling_video, generate_ffmpeg_comp
 import background_removal
-from elevenlabs.client import ElevenLabs
 from fastapi.middleware.cors import CORSMiddleware
-from tts import tts_from_script
+from tts import tts_from_script, get_client as get_tts_client
 from veed import generate_avatar_video, lip_sync_video_audio
 from fal_kling_duet import generate_kling_duet_video
-from finale import overlay_videos_and_upload
+from duet import run_duet
+from video_summary import summarize_video_async
+from cancellation import ClientDisconnected, run_until_disconnect
+import cancellation
+import render_plans
+import job_queue
+import provider_status
+import admission
+import auth
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -19,6 +36,90 @@ load_dotenv()
 
 app = FastAPI()
 
+
+def avatar_background_removal(payload: dict, cancel_event=None) -> dict:
+    return {"video_url": background_removal.remove_background_from_video_url(payload["video"]["url"], cancel_event)}
+
+
+fal_jobs.register_follow_up("avatar_background_removal", avatar_background_removal)
+
+
+def get_user_id(http_request: Request) -> str:
+    # The user from the verified Supabase access token; anonymous callers are budgeted by address
+    if not hasattr(http_request.state, "user_id"):
+        try:
+            user_id = auth.verified_user_id(http_request.headers.get("Authorization"))
+        except auth.InvalidToken as e:
+            raise HTTPException(status_code=401, detail=f"Invalid access token: {e}")
+        http_request.state.user_id = user_id or auth.anonymous_id(
+            http_request.headers.get("X-Forwarded-For"),
+            http_request.client.host if http_request.client else None,
+        )
+    return http_request.state.user_id
+
+
+def signed_in_user_id(http_request: Request) -> str | None:
+    user_id = get_user_id(http_request)
+    return None if user_id.startswith(auth.ANONYMOUS_PREFIX) else user_id
+
+def _rejected(e: admission.AdmissionRejected) -> HTTPException:
+    headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+
+# Reservations kept past their request until the fal jobs they admitted end
+_kept_reservations = set()
+
+
+@contextmanager
+def admitted(http_request: Request, cost: dict):
+    # The request's jobs count against the caller's budgets and concurrency until it returns,
+    # or until the fal jobs handed to keep_until_finished() end
+    user_id = get_user_id(http_request)
+    try:
+        admission.reserve(user_id, cost)
+    except admission.AdmissionRejected as e:
+        raise _rejected(e)
+    reservation = {"user_id": user_id, "cost": cost, "kept": False}
+    try:
+        yield reservation
+    finally:
+        if not reservation["kept"]:
+            admission.release(user_id, cost)
+
+
+async def _release_when_finished(reservation: dict, jobs: list):
+    try:
+        await asyncio.gather(*(fal_jobs.wait_until_finished(job) for job in jobs), return_exceptions=True)
+    finally:
+        admission.release(reservation["user_id"], reservation["cost"])
+
+
+def keep_until_finished(reservation: dict, jobs: list):
+    # In webhook mode handlers return as soon as fal accepts the jobs, which then still count
+    # against the caller's concurrency until they complete, fail or are cancelled
+    pending = [job for job in jobs if isinstance(job, dict) and "request_id" in job]
+    if not fal_jobs.webhook_mode_enabled() or not pending:
+        return
+    reservation["kept"] = True
+    task = asyncio.create_task(_release_when_finished(reservation, pending))
+    _kept_reservations.add(task)
+    task.add_done_callback(_kept_reservations.discard)
+
+
+async def estimated(estimate, url: str) -> float:
+    # Probing reads the file's headers over the network, so it runs off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, estimate, url)
+
+
+def charge(http_request: Request, cost: dict):
+    # For work that outlives the request, e.g. adventures: only the hourly budgets apply
+    try:
+        admission.reserve(get_user_id(http_request), cost, concurrent=False)
+    except admission.AdmissionRejected as e:
+        raise _rejected(e)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -45,13 +146,18 @@ class ScriptRequest(BaseModel):
 class BackgroundRemovalRequest(BaseModel):
     image_url: str
 
+class BatchBackgroundRemovalRequest(BaseModel):
+    image_urls: list[str]
+
 class KlingRequest(BaseModel):
     prompt: str
     image_url_1: str
+    priority: str = "interactive"
 
 class MultiKlingRequest(BaseModel):
     prompts: list[str]
     image_url: str
+    priority: str = "interactive"
 
 class TTSRequest(BaseModel):
     text: str
@@ -67,10 +173,50 @@ class KlingDuetRequest(BaseModel):
     prompt: str
     image_url_1: str
     image_url_2: str
+    priority: str = "interactive"
 
 class VideoOverlayRequest(BaseModel):
     background_url: str
     overlay_url: str
+    preview: bool = False
+
+class AdventureRequest(BaseModel):
+    prompt: str
+    image_url: str
+
+class WorkerClaimRequest(BaseModel):
+    worker_id: str
+    kinds: list[str] | None = None
+
+class WorkerReportRequest(BaseModel):
+    worker_id: str
+    result: dict | None = None
+    error: str | None = None
+
+
+@app.on_event("startup")
+async def calibrate_encoder():
+    # Measure encode throughput without delaying the first request
+    encoder.calibrate_in_background()
+
+
+@app.on_event("startup")
+async def warm_providers():
+    # Providers otherwise load on the first request that needs them
+    if lazy_imports.WARM_START == "background":
+        lazy_imports.warm_up(initializers=[gemini.get_client, get_tts_client])
+
+
+@app.on_event("startup")
+async def start_workspace_janitor():
+    # Clears job directories left behind by crashed processes
+    workspace.start_janitor()
+
+
+@app.on_event("startup")
+async def recover_final_renders():
+    # Final renders queued by a process that has since died would otherwise never finish
+    render_queue.recover_renders()
 
 
 @app.get("/")
@@ -91,35 +237,22 @@ async def generate_storyline(scene_request: SceneRequest):
 
 
 @app.post("/summary-of-videos/")
-async def summary_of_videos(video_request: VideoRequest):
-
-    try:
-        video = sieve.File(url=video_request.video_url)
-        prompt = video_request.prompt
-        start_time = 0
-        end_time = -1
-        backend = "sieve-fast"
-        
-
-        ask = sieve.function.get("sieve/ask")
-        output = ask.push(
-            video,
-            prompt,
-            start_time,
-            end_time,
-            backend
-        )
-        print('This is printing while a job is running in the background!')
-        print(output.result())
-
-    # Run the blocking output.result() in a separate thread
-        loop = asyncio.get_running_loop()
-        result = await loop.run_in_executor(None, output.result)
-
-        return {"summary": result}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def summary_of_videos(video_request: VideoRequest, http_request: Request):
+    with admitted(http_request, admission.cost(provider_calls=1)):
+        try:
+            # The Sieve job is cancelled if the client disconnects while it runs
+            result = await run_until_disconnect(
+                http_request,
+                summarize_video_async(video_request.video_url, video_request.prompt),
+                "summary-of-videos"
+            )
+
+            return {"summary": result}
+
+        except ClientDisconnected as e:
+            raise HTTPException(status_code=499, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
     
 
 @app.post("/generate-script/")
@@ -136,105 +269,134 @@ async def generate_storyline(scene_request: ScriptRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def generate_kling_video(prompt, image_url):
-    try:
-        handler = await fal_client.submit_async(
-            "fal-ai/kling-video/v1.6/standard/elements",
-            arguments={
-                "prompt": prompt,
-                "input_image_urls": [image_url, image_url]  # Using the same image twice
-            },
-        )
-        result = await handler.get()
-        return result
-    except Exception as e:
-        raise Exception(f"Error generating Kling video: {str(e)}")
-
-
 @app.post("/generate-kling-video/")
-async def kling_video_endpoint(kling_request: KlingRequest):
-    try:
-        result = await generate_kling_video(
-            kling_request.prompt,
-            kling_request.image_url_1
-        )
+async def kling_video_endpoint(kling_request: KlingRequest, http_request: Request):
+    with admitted(http_request, admission.cost(kling_jobs=1)) as reservation:
+        try:
+            result = await generate_kling_video(
+                kling_request.prompt,
+                kling_request.image_url_1,
+                wait=False,
+                user_id=get_user_id(http_request),
+                priority=kling_request.priority
+            )
+            keep_until_finished(reservation, [result])
         
-        return {
-            "status": "processing",
-            "result": result
-        }
+            return {
+                "status": "processing",
+                "result": result
+            }
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/generate-multiple-kling-videos/")
-async def generate_multiple_videos(request: MultiKlingRequest):
-    try:
-        # Create a list of tasks for concurrent execution
-        tasks = [
-            generate_kling_video(prompt, request.image_url)
-            for prompt in request.prompts
-        ]
+async def generate_multiple_videos(request: MultiKlingRequest, http_request: Request):
+    with admitted(http_request, admission.cost(kling_jobs=len(request.prompts))) as reservation:
+        try:
+            user_id = get_user_id(http_request)
+
+            # Create a list of tasks for concurrent execution through the shared Kling queue
+            tasks = [
+                generate_kling_video(prompt, request.image_url, wait=False, user_id=user_id, priority=request.priority)
+                for prompt in request.prompts
+            ]
         
-        # Execute all tasks concurrently
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+            # Execute all tasks concurrently; a disconnect cancels every queued or running job
+            results = await run_until_disconnect(
+                http_request,
+                asyncio.gather(*tasks, return_exceptions=True),
+                "generate-multiple-kling-videos"
+            )
         
-        # Process results and handle any exceptions
-        processed_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                processed_results.append({
-                    "prompt": request.prompts[i],
-                    "status": "error",
-                    "error": str(result)
-                })
-            else:
-                processed_results.append({
-                    "prompt": request.prompts[i],
-                    "status": "processing",
-                    "result": result
-                })
+            keep_until_finished(reservation, results)
+
+            # Process results and handle any exceptions
+            processed_results = []
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    processed_results.append({
+                        "prompt": request.prompts[i],
+                        "status": "error",
+                        "error": str(result)
+                    })
+                else:
+                    processed_results.append({
+                        "prompt": request.prompts[i],
+                        "status": "processing",
+                        "result": result
+                    })
         
-        return {
-            "status": "processing",
-            "results": processed_results
-        }
+            return {
+                "status": "processing",
+                "results": processed_results
+            }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except ClientDisconnected as e:
+            raise HTTPException(status_code=499, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/remove-background/")
-async def remove_background(request: BackgroundRemovalRequest):
-    try:
-        result_url = background_removal.remove_background_from_supabase_url(request.image_url)
-        return {"background_removed_url": result_url}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def remove_background(request: BackgroundRemovalRequest, http_request: Request):
+    with admitted(http_request, admission.cost(provider_calls=1)):
+        try:
+            # Runs in a worker process when RENDER_MODE=queue
+            return await job_queue.run_job("remove_background_image", {"image_url": request.image_url})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/remove-background-batch/")
+async def remove_background_batch(request: BatchBackgroundRemovalRequest, http_request: Request):
+    if len(request.image_urls) > background_removal.MAX_BATCH_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {background_removal.MAX_BATCH_IMAGES} images per batch")
+    # Every image is its own Sieve call
+    with admitted(http_request, admission.cost(provider_calls=len(request.image_urls))):
+        try:
+            # One request for a pet's whole photo set
+            return await job_queue.run_job("remove_background_images", {"image_urls": request.image_urls})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/tts-from-script/")
-async def generate_tts_from_script(request: TTSRequest):
-    try:
+async def generate_tts_from_script(request: TTSRequest, http_request: Request):
+    with admitted(http_request, admission.cost(provider_calls=1)):
+        try:
 
-        audio_path = tts_from_script(request.text)
+            audio_path = tts_from_script(request.text)
 
-        return {"audio_path": audio_path}
+            return {"audio_path": audio_path}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/generate-avatar-video/")
-async def avatar_video(request: AvatarRequest):
-    try:
-        lip_sync_result = await generate_avatar_video(request.audio_url)
-        result = background_removal.remove_background_from_video_url(lip_sync_result["video"]["url"])
-
-        return {"video_url": result}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def avatar_video(request: AvatarRequest, http_request: Request):
+    avatar_minutes = await estimated(admission.estimate_avatar_minutes, request.audio_url)
+    with admitted(http_request, admission.cost(avatar_minutes=avatar_minutes, renders=1)) as reservation:
+        try:
+            # Returns {"video_url"} directly, or the queued job record in webhook mode
+            result = await run_until_disconnect(
+                http_request,
+                generate_avatar_video(
+                    request.audio_url,
+                    wait=False,
+                    follow_up="avatar_background_removal"
+                ),
+                "generate-avatar-video"
+            )
+            # The follow-up background removal runs until the job record completes
+            keep_until_finished(reservation, [result])
+            return result
+        except ClientDisconnected as e:
+            raise HTTPException(status_code=499, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 # @app.post("/lip-sync-video-audio/")
@@ -247,33 +409,260 @@ async def avatar_video(request: AvatarRequest):
 #     
 
 @app.post("/stitch-scenes/")
-async def stitch_scenes(request: SceneStitchRequest):
-    try:
-        result = await generate_ffmpeg_comp(request.scenes)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def stitch_scenes(request: SceneStitchRequest, http_request: Request):
+    with admitted(http_request, admission.cost(provider_calls=1)) as reservation:
+        try:
+            result = await generate_ffmpeg_comp(request.scenes, wait=False)
+            keep_until_finished(reservation, [result])
+            return result
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-kling-duet/")
-async def kling_duet(request: KlingDuetRequest):
-    try:
-        result = await generate_kling_duet_video(request.prompt, request.image_url_1, request.image_url_2)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def kling_duet(request: KlingDuetRequest, http_request: Request):
+    with admitted(http_request, admission.cost(kling_jobs=1)) as reservation:
+        try:
+            result = await generate_kling_duet_video(
+                request.prompt,
+                request.image_url_1,
+                request.image_url_2,
+                wait=False,
+                user_id=get_user_id(http_request),
+                priority=request.priority
+            )
+            keep_until_finished(reservation, [result])
+            return result
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/duets/")
+async def create_duet(request: KlingDuetRequest, http_request: Request):
+    # Whole duet server-side, streamed as server-sent events until the re-hosted video is ready
+    charge(http_request, admission.cost(kling_jobs=1))
+    events = run_duet(
+        request.prompt,
+        request.image_url_1,
+        request.image_url_2,
+        user_id=get_user_id(http_request),
+        priority=request.priority,
+        # Anonymous duets get a random folder in run_duet
+        storage_folder=signed_in_user_id(http_request)
+    )
+
+    async def event_stream():
+        try:
+            async for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'stage': 'failed', 'status': 'failed', 'error': str(e)})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 @app.post("/remove-background-video/")
-async def remove_background(request: BackgroundRemovalRequest):
+async def remove_background(request: BackgroundRemovalRequest, http_request: Request):
+    encode_seconds = await estimated(admission.estimate_encode_seconds, request.image_url)
+    with admitted(http_request, admission.cost(encode_seconds=encode_seconds, renders=1)):
+        try:
+            return await job_queue.run_job("remove_background_video", {"video_url": request.image_url})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/final-overlay")
+async def overlay_video_endpoint(req: VideoOverlayRequest, http_request: Request):
+    # The output is as long as the background; a preview is followed by the full-quality render
+    encode_seconds = await estimated(admission.estimate_encode_seconds, req.background_url)
+    if req.preview:
+        encode_seconds *= 2
+    with admitted(http_request, admission.cost(encode_seconds=encode_seconds, renders=1)):
+        try:
+            payload = {"background_url": req.background_url, "overlay_url": req.overlay_url}
+            if req.preview:
+                # Low-resolution proxy now, full-quality render queued behind it
+                if job_queue.RENDER_MODE == "queue":
+                    render = await render_queue.queue_preview(req.background_url, req.overlay_url)
+                else:
+                    render = await job_queue.run_job("overlay_preview", payload)
+                return {"status": "preview", "render_id": render["id"], "video_url": render["video_url"]}
+
+            result = await job_queue.run_job("overlay_render", payload)
+            return {"status": "success", "video_url": result["video_url"]}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/adventures/")
+async def create_adventure(request: AdventureRequest, http_request: Request):
+    charge(http_request, admission.adventure_cost())
     try:
-        result_url = background_removal.remove_background_from_video_url(request.url)
-        return {"background_removed_url": result_url}
+        adventure_id = checkpoints.create_adventure({
+            "prompt": request.prompt,
+            "image_url": request.image_url,
+            "user_id": get_user_id(http_request)
+        })
+        adventure.start_adventure(adventure_id)
+        return {"adventure_id": adventure_id, "status": "running"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/final-overlay")
-async def overlay_video_endpoint(req: VideoOverlayRequest):
+
+@app.get("/adventures/{adventure_id}")
+async def get_adventure(adventure_id: str):
+    result = checkpoints.get_adventure(adventure_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Adventure not found")
+    return result
+
+
+@app.post("/adventures/{adventure_id}/resume")
+async def resume_adventure(adventure_id: str, http_request: Request):
+    result = checkpoints.get_adventure(adventure_id)
+    # Only the caller who started an adventure can resume it, and the rerun is billed to them
+    if result is None or result["inputs"].get("user_id") != get_user_id(http_request):
+        raise HTTPException(status_code=404, detail="Adventure not found")
+
+    # Stages with a stored checkpoint are skipped by the pipeline, so only the others are charged,
+    # and nothing is when the adventure is already running here
+    if not adventure.is_running(adventure_id):
+        charge(http_request, admission.adventure_cost(result["stages"].keys()))
+    started = adventure.start_adventure(adventure_id)
+    return {
+        "adventure_id": adventure_id,
+        "status": "running",
+        "resumed": started,
+        "completed_stages": list(result["stages"].keys())
+    }
+
+
+@app.post("/webhooks/fal")
+async def fal_webhook(request: Request):
+    if fal_jobs.FAL_WEBHOOK_TOKEN and request.query_params.get("token") != fal_jobs.FAL_WEBHOOK_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid webhook token")
+
+    raw_body = await request.body()
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, fal_jobs.verify_webhook_signature, request.headers, raw_body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
     try:
-        video_url = overlay_videos_and_upload(req.background_url, req.overlay_url)
-        return {"status": "success", "video_url": video_url}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        body = json.loads(raw_body)
+        await fal_jobs.handle_webhook(body)
+        return {"status": "ok"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/fal-jobs/{request_id}")
+async def get_fal_job(request_id: str):
+    # Also picks up the result of a job whose webhook never arrived
+    job = await fal_jobs.reconcile_job(request_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # Queue position is known while this process is waiting on the job, the estimate always
+    progress = provider_status.get_status(request_id)
+    if progress is None and job["status"] == "IN_QUEUE" and job["application"]:
+        progress = {"estimated_completion_at": provider_status.estimate_completion(job["application"], job["created_at"])}
+    return {**job, "progress": progress}
+
+
+@app.get("/provider-jobs")
+async def list_provider_jobs():
+    return {"jobs": provider_status.live_jobs()}
+
+
+@app.get("/provider-jobs/{job_id}")
+async def get_provider_job(job_id: str):
+    job = provider_status.get_status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/metrics/provider-durations")
+async def provider_duration_metrics():
+    return provider_status.all_duration_stats()
+
+
+@app.get("/renders/{render_id}")
+async def get_render(render_id: str):
+    render = render_queue.get_render(render_id)
+    if render is None:
+        raise HTTPException(status_code=404, detail="Render not found")
+    return render
+
+
+@app.get("/kling-queue")
+async def kling_queue(http_request: Request):
+    # Queue positions of the caller's Kling jobs that have not been submitted yet
+    return {
+        "queued": kling_scheduler.user_queue(get_user_id(http_request)),
+        **kling_scheduler.stats()
+    }
+
+
+@app.get("/metrics/cancellations")
+async def cancellation_metrics():
+    return cancellation.metrics()
+
+
+@app.get("/metrics/render-cache")
+async def render_cache_metrics():
+    return render_plans.cache_stats()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.describe_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/metrics/utilization")
+async def utilization_metrics(http_request: Request):
+    # Node-wide load plus the caller's own budgets
+    return {"user": admission.user_usage(get_user_id(http_request)), **admission.utilization()}
+
+
+@app.get("/metrics/job-queue")
+async def job_queue_metrics():
+    return {"mode": job_queue.RENDER_MODE, **job_queue.queue_stats()}
+
+
+def authorize_worker(http_request: Request):
+    # Remote workers share JOB_WORKER_TOKEN with the API; without one the endpoints do not exist
+    if not job_queue.JOB_WORKER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {job_queue.JOB_WORKER_TOKEN}"
+    if not hmac.compare_digest(http_request.headers.get("Authorization", ""), expected):
+        raise HTTPException(status_code=401, detail="Invalid worker token")
+
+
+@app.post("/worker/jobs/claim")
+async def worker_claim_job(request: WorkerClaimRequest, http_request: Request):
+    # Workers on other nodes take jobs through the API, which keeps the queue on its local disk
+    authorize_worker(http_request)
+    job_queue.requeue_stale_jobs()
+    return {"job": job_queue.claim(request.worker_id, request.kinds)}
+
+
+@app.post("/worker/jobs/{job_id}/heartbeat")
+async def worker_heartbeat(job_id: str, request: WorkerReportRequest, http_request: Request):
+    authorize_worker(http_request)
+    if not job_queue.heartbeat(job_id, request.worker_id):
+        raise HTTPException(status_code=409, detail="Job is not running on this worker")
+    return {"status": "running"}
+
+
+@app.post("/worker/jobs/{job_id}/complete")
+async def worker_complete_job(job_id: str, request: WorkerReportRequest, http_request: Request):
+    authorize_worker(http_request)
+    if not job_queue.complete(job_id, request.result or {}, request.worker_id):
+        raise HTTPException(status_code=409, detail="Job is not running on this worker")
+    return {"status": "completed"}
+
+
+@app.post("/worker/jobs/{job_id}/fail")
+async def worker_fail_job(job_id: str, request: WorkerReportRequest, http_request: Request):
+    authorize_worker(http_request)
+    if not job_queue.fail(job_id, request.error or "Worker reported a failure", request.worker_id):
+        raise HTTPException(status_code=409, detail="Job is not running on this worker")
+    return {"status": "failed"}
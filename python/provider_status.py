@@ -0,0 +1,187 @@
+import os
+import statistics
+import threading
+import time
+from contextlib import closing
+from dotenv import load_dotenv
+from local_db import connect
+
+# Load environment variables
+load_dotenv()
+
+# Most recent durations kept per model for the rolling estimates
+ROLLING_WINDOW = 50
+# Guess for a model with no history yet
+DEFAULT_EXPECTED_SECONDS = 60
+
+MIN_POLL_SECONDS = float(os.getenv("MIN_POLL_SECONDS", "1"))
+MAX_POLL_SECONDS = float(os.getenv("MAX_POLL_SECONDS", "30"))
+
+# Provider jobs this process is currently waiting on, by provider job id
+_live = {}
+_live_lock = threading.Lock()
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS provider_durations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                queue_seconds REAL,
+                run_seconds REAL,
+                total_seconds REAL NOT NULL,
+                finished_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS provider_durations_model ON provider_durations (model, id);
+        """)
+    _schema_ready = True
+
+
+def record_duration(model: str, total_seconds: float, queue_seconds: float = None, run_seconds: float = None):
+    # queue/run split is only known when something watched the job start running
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO provider_durations (model, queue_seconds, run_seconds, total_seconds, finished_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (model, queue_seconds, run_seconds, total_seconds, time.time()),
+        )
+        conn.execute(
+            "DELETE FROM provider_durations WHERE model = ? AND id NOT IN "
+            "(SELECT id FROM provider_durations WHERE model = ? ORDER BY id DESC LIMIT ?)",
+            (model, model, ROLLING_WINDOW),
+        )
+
+
+def duration_stats(model: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT queue_seconds, run_seconds, total_seconds FROM provider_durations WHERE model = ?",
+            (model,),
+        ).fetchall()
+    if not rows:
+        return None
+
+    totals = sorted(row["total_seconds"] for row in rows)
+    runs = [row["run_seconds"] for row in rows if row["run_seconds"] is not None]
+    total_median = statistics.median(totals)
+    run_median = statistics.median(runs) if runs else total_median
+
+    return {
+        "samples": len(rows),
+        "total_median": total_median,
+        "total_p90": totals[int(0.9 * (len(totals) - 1))],
+        "run_median": run_median,
+        "queue_median": max(0.0, total_median - run_median),
+    }
+
+
+def all_duration_stats() -> dict:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        models = [row["model"] for row in conn.execute("SELECT DISTINCT model FROM provider_durations")]
+    return {model: duration_stats(model) for model in models}
+
+
+def _estimate_completion(job: dict, stats: dict | None) -> float:
+    now = time.time()
+    run_median = stats["run_median"] if stats else DEFAULT_EXPECTED_SECONDS
+    queue_median = stats["queue_median"] if stats else 0.0
+
+    if job["started_at"]:
+        return job["started_at"] + run_median
+    return max(job["submitted_at"] + queue_median, now) + run_median
+
+
+def _public(job: dict) -> dict:
+    # An overdue job is reported as finishing any moment now, never in the past
+    return {**job, "estimated_completion_at": max(job["estimated_completion_at"], time.time())}
+
+
+def estimate_completion(model: str, submitted_at: float) -> float:
+    # For jobs nobody in this process is watching, e.g. webhook jobs submitted without waiting
+    job = {"submitted_at": submitted_at, "started_at": None}
+    return max(_estimate_completion(job, duration_stats(model)), time.time())
+
+
+def track(job_id: str, provider: str, model: str, submitted_at: float = None):
+    job = {
+        "job_id": job_id,
+        "provider": provider,
+        "model": model,
+        "status": "IN_QUEUE",
+        "queue_position": None,
+        "submitted_at": submitted_at or time.time(),
+        "started_at": None,
+    }
+    job["estimated_completion_at"] = _estimate_completion(job, duration_stats(model))
+    with _live_lock:
+        _live[job_id] = job
+
+
+def update(job_id: str, status: str, queue_position: int = None):
+    with _live_lock:
+        job = _live.get(job_id)
+        if job is None:
+            return
+        job["status"] = status
+        job["queue_position"] = queue_position
+        if status == "IN_PROGRESS" and not job["started_at"]:
+            job["started_at"] = time.time()
+        model = job["model"]
+
+    stats = duration_stats(model)
+    with _live_lock:
+        if job_id in _live:
+            job["estimated_completion_at"] = _estimate_completion(job, stats)
+
+
+def finish(job_id: str, succeeded: bool = True) -> dict | None:
+    # Successful jobs feed the rolling statistics; failures would skew them
+    with _live_lock:
+        job = _live.pop(job_id, None)
+    if job is None or not succeeded:
+        return job
+
+    now = time.time()
+    if job["started_at"]:
+        record_duration(job["model"], now - job["submitted_at"], job["started_at"] - job["submitted_at"], now - job["started_at"])
+    else:
+        record_duration(job["model"], now - job["submitted_at"])
+    return job
+
+
+def get_status(job_id: str) -> dict | None:
+    with _live_lock:
+        job = _live.get(job_id)
+        return _public(job) if job else None
+
+
+def live_jobs() -> list[dict]:
+    with _live_lock:
+        return [_public(job) for job in _live.values()]
+
+
+def next_poll_interval(job_id: str) -> float:
+    # Sparse while far from the expected finish, tight around it, backing off again once overdue
+    with _live_lock:
+        job = _live.get(job_id)
+        if job is None:
+            return MIN_POLL_SECONDS
+        status, expected_at = job["status"], job["estimated_completion_at"]
+
+    remaining = expected_at - time.time()
+    if status == "IN_QUEUE" and remaining > 0:
+        interval = remaining / 2
+    elif remaining > 0:
+        interval = remaining / 4
+    else:
+        interval = -remaining / 5
+    return min(MAX_POLL_SECONDS, max(MIN_POLL_SECONDS, interval))
@@ -0,0 +1,47 @@
+import os
+import requests
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# The job queue stays in the API's SQLite database; workers on other nodes reach it through
+# the API's /worker/jobs endpoints. Same functions as job_queue, so worker.py can use either.
+JOB_QUEUE_URL = (os.getenv("JOB_QUEUE_URL") or "").rstrip("/")
+JOB_WORKER_TOKEN = os.getenv("JOB_WORKER_TOKEN")
+REQUEST_TIMEOUT = (10, 30)
+
+
+def _post(path: str, body: dict) -> requests.Response | None:
+    # None when the API says the job is no longer this worker's
+    response = requests.post(
+        f"{JOB_QUEUE_URL}/worker/jobs{path}",
+        json=body,
+        headers={"Authorization": f"Bearer {JOB_WORKER_TOKEN}"},
+        timeout=REQUEST_TIMEOUT,
+    )
+    if response.status_code == 409:
+        return None
+    response.raise_for_status()
+    return response
+
+
+def claim(worker_id: str, kinds: list[str] = None) -> dict | None:
+    return _post("/claim", {"worker_id": worker_id, "kinds": kinds}).json()["job"]
+
+
+def heartbeat(job_id: str, worker_id: str = None) -> bool:
+    return _post(f"/{job_id}/heartbeat", {"worker_id": worker_id}) is not None
+
+
+def complete(job_id: str, result: dict, worker_id: str = None) -> bool:
+    return _post(f"/{job_id}/complete", {"worker_id": worker_id, "result": result}) is not None
+
+
+def fail(job_id: str, error: str, worker_id: str = None) -> bool:
+    return _post(f"/{job_id}/fail", {"worker_id": worker_id, "error": error}) is not None
+
+
+def requeue_stale_jobs() -> int:
+    # The API requeues jobs from lost workers before every claim
+    return 0
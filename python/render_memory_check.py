@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from ffmpeg_tools import ffmpeg_exe
+
+# Usage: python render_memory_check.py
+# Renders a synthetic adventure-length input and 1- and 10-minute inputs through render_overlay
+# and exits non-zero if any of them skips the streaming path or peak memory grows with duration.
+# A typical adventure: five 5-second Kling scenes stitched together
+ADVENTURE_SECONDS = 25
+SHORT_SECONDS = 60
+LONG_SECONDS = 600
+# Peak RSS of the long render may exceed the short one by at most this factor
+TOLERANCE = 1.2
+
+
+def _synthetic_input(path: str, seconds: int, size: str, with_audio: bool):
+    command = [ffmpeg_exe(), "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}"]
+    if with_audio:
+        command += ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-c:a", "aac"]
+    command += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", path]
+    subprocess.run(command, check=True)
+
+
+def _render_peak_rss(background_path: str, overlay_path: str, output_path: str, results):
+    # Runs in its own process so each render's peak is measured separately
+    import finale
+    from workspace import Workspace
+
+    inputs = {
+        # Quota large enough that the check never stops the render
+        "workspace": Workspace(os.path.dirname(output_path), quota_bytes=1 << 40),
+        "background_path": background_path,
+        "overlay_path": overlay_path,
+        # Empty string skips the Scout music search
+        "music_path": "",
+    }
+    started = time.monotonic()
+    # The same entry point as production, so the streaming gate is exercised too
+    finale.render_overlay(inputs, output_path)
+    results.put({
+        "seconds": time.monotonic() - started,
+        # ru_maxrss is in kilobytes on Linux; children are the ffmpeg/ffprobe processes
+        "ffmpeg_peak_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "python_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    })
+
+
+def measure(duration_seconds: int, directory: str) -> dict:
+    background_path = f"{directory}/background_{duration_seconds}.mp4"
+    overlay_path = f"{directory}/overlay_{duration_seconds}.mp4"
+    _synthetic_input(background_path, duration_seconds, "1280x720", with_audio=True)
+    _synthetic_input(overlay_path, duration_seconds, "480x480", with_audio=True)
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_render_peak_rss,
+        args=(background_path, overlay_path, f"{directory}/output_{duration_seconds}.mp4", results),
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Render of {duration_seconds}s input failed")
+
+    result = results.get()
+    print(
+        f"{duration_seconds:>4}s input: rendered in {result['seconds']:.1f}s, "
+        f"ffmpeg peak {result['ffmpeg_peak_mb']:.0f} MB, python peak {result['python_peak_mb']:.0f} MB"
+    )
+    return result
+
+
+if __name__ == "__main__":
+    import finale
+
+    for seconds in (ADVENTURE_SECONDS, SHORT_SECONDS, LONG_SECONDS):
+        if not finale.use_streaming_render(seconds):
+            print(f"FAIL: a {seconds}s input renders through moviepy, STREAMING_RENDER_MIN_SECONDS is {finale.STREAMING_MIN_SECONDS:.0f}")
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        adventure = measure(ADVENTURE_SECONDS, directory)
+        short = measure(SHORT_SECONDS, directory)
+        long = measure(LONG_SECONDS, directory)
+
+    for key in ("ffmpeg_peak_mb", "python_peak_mb"):
+        if long[key] > min(adventure[key], short[key]) * TOLERANCE:
+            print(f"FAIL: {key} grew from {min(adventure[key], short[key]):.0f} MB to {long[key]:.0f} MB")
+            sys.exit(1)
+    print("OK: adventure-length renders stream and peak memory does not grow with duration")
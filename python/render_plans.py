@@ -0,0 +1,199 @@
+import json
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from ffmpeg_tools import ffprobe_exe
+from lazy_imports import lazy_import
+
+ffmpeg_reader = lazy_import("moviepy.video.io.ffmpeg_reader")
+
+# Renders whose durations fall in the same bucket share a plan
+DURATION_BUCKET_SECONDS = 5
+
+# Proxy renders shown on the dashboard while the full-quality render is queued
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 15
+PREVIEW_BITRATE = "400k"
+
+PROBE_CACHE_SIZE = 512
+# Remote probes only read the file's headers, which should not take long
+REMOTE_PROBE_TIMEOUT_SECONDS = 15
+
+_plans = {}
+_plans_lock = threading.Lock()
+# Probe results by source URL, or by local file for inputs without one
+_probes = OrderedDict()
+_probes_lock = threading.Lock()
+_stats = {"plan_hits": 0, "plan_misses": 0, "probe_hits": 0, "probe_misses": 0}
+
+
+def _probe_file(path: str) -> dict:
+    if ffprobe_exe() is None:
+        infos = ffmpeg_reader.ffmpeg_parse_infos(path)
+        width, height = infos["video_size"]
+        return {
+            "width": int(width),
+            "height": int(height),
+            "duration": float(infos.get("duration") or 0),
+            "has_audio": bool(infos.get("audio_found")),
+        }
+
+    result = subprocess.run(
+        [ffprobe_exe(), "-v", "error", "-print_format", "json", "-show_streams", "-show_format", path],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    info = json.loads(result.stdout)
+    video = next(stream for stream in info["streams"] if stream["codec_type"] == "video")
+
+    return {
+        "width": int(video["width"]),
+        "height": int(video["height"]),
+        "duration": float(info["format"].get("duration") or video.get("duration") or 0),
+        "has_audio": any(stream["codec_type"] == "audio" for stream in info["streams"]),
+    }
+
+
+def cached_probe(source_url: str | None) -> dict | None:
+    # Provider outputs and content-addressed uploads never change, so a URL's probe holds across renders
+    if not source_url:
+        return None
+    with _probes_lock:
+        info = _probes.get(source_url)
+        if info is not None:
+            _probes.move_to_end(source_url)
+            _stats["probe_hits"] += 1
+        return info
+
+
+def remember_probe(source_url: str | None, info: dict) -> dict:
+    # Also takes what moviepy read when it opened a file, so the file is not probed a second time
+    if source_url:
+        with _probes_lock:
+            _probes[source_url] = info
+            _probes.move_to_end(source_url)
+            while len(_probes) > PROBE_CACHE_SIZE:
+                _probes.popitem(last=False)
+    return info
+
+
+def probe(path: str, source_url: str = None) -> dict:
+    # Each render downloads into a fresh workspace, so the local path alone would never hit
+    stat = os.stat(path)
+    key = source_url or f"{path}:{stat.st_size}:{stat.st_mtime}"
+    info = cached_probe(key)
+    if info is not None:
+        return info
+
+    with _probes_lock:
+        _stats["probe_misses"] += 1
+    return remember_probe(key, _probe_file(path))
+
+
+def probe_duration(source_url: str) -> float:
+    # Length of a remote file without downloading it; a cached probe answers first
+    info = cached_probe(source_url)
+    if info is not None:
+        return info["duration"]
+    if not source_url.startswith(("http://", "https://")):
+        raise ValueError(f"Not an http(s) URL: {source_url}")
+
+    if ffprobe_exe() is None:
+        return float(ffmpeg_reader.ffmpeg_parse_infos(source_url).get("duration") or 0)
+    result = subprocess.run(
+        [ffprobe_exe(), "-v", "error", "-protocol_whitelist", "http,https,tcp,tls",
+         "-show_entries", "format=duration", "-print_format", "json", source_url],
+        check=True,
+        capture_output=True,
+        text=True,
+        timeout=REMOTE_PROBE_TIMEOUT_SECONDS,
+    )
+    return float(json.loads(result.stdout)["format"].get("duration") or 0)
+
+
+def compute_overlay_geometry(bg_width: int, bg_height: int, ov_width: int, ov_height: int) -> dict:
+    # Max allowable overlay dimensions
+    max_width = bg_width * 0.25
+    max_height = bg_height * 0.5
+
+    # Maintain aspect ratio while fitting within max dimensions
+    aspect_ratio = ov_width / ov_height
+
+    if ov_width / max_width > ov_height / max_height:
+        # Width is the limiting factor
+        target_width = max_width
+        target_height = target_width / aspect_ratio
+    else:
+        # Height is the limiting factor
+        target_height = max_height
+        target_width = target_height * aspect_ratio
+
+    return {
+        "width": int(target_width),
+        "height": int(target_height),
+        "x": int(bg_width - target_width),
+        "y": int(bg_height - target_height),
+    }
+
+
+def _even(value: float) -> int:
+    # x264 with yuv420p needs even dimensions
+    return max(2, int(value) // 2 * 2)
+
+
+def _build_plan(bg_width: int, bg_height: int, ov_width: int, ov_height: int, duration_bucket: int, preview: bool) -> dict:
+    if preview and bg_height > PREVIEW_HEIGHT:
+        canvas_width = _even(bg_width * PREVIEW_HEIGHT / bg_height)
+        canvas_height = PREVIEW_HEIGHT
+    else:
+        canvas_width, canvas_height = bg_width, bg_height
+
+    overlay = compute_overlay_geometry(canvas_width, canvas_height, ov_width, ov_height)
+
+    # Same layout as an ffmpeg filter graph, for renders that bypass moviepy
+    filter_graph = (
+        f"[0:v]scale={canvas_width}:{canvas_height}[bg];"
+        f"[1:v]scale={overlay['width']}:{overlay['height']}[ov];"
+        f"[bg][ov]overlay={overlay['x']}:{overlay['y']}:eof_action=pass,format=yuv420p[v]"
+    )
+
+    return {
+        "preview": preview,
+        "duration_bucket": duration_bucket,
+        "canvas": {"width": canvas_width, "height": canvas_height},
+        "background_resized": (canvas_width, canvas_height) != (bg_width, bg_height),
+        "overlay": overlay,
+        "filter_graph": filter_graph,
+        "fps": PREVIEW_FPS if preview else None,
+        "bitrate": PREVIEW_BITRATE if preview else None,
+    }
+
+
+def get_render_plan(background: dict, overlay: dict, preview: bool = False) -> dict:
+    # background and overlay are probe() results
+    duration = min(background["duration"], overlay["duration"]) or background["duration"]
+    duration_bucket = int(duration // DURATION_BUCKET_SECONDS)
+    key = (background["width"], background["height"], overlay["width"], overlay["height"], duration_bucket, preview)
+
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _stats["plan_hits"] += 1
+            return plan
+        _stats["plan_misses"] += 1
+
+    plan = _build_plan(*key)
+    with _plans_lock:
+        _plans[key] = plan
+    return plan
+
+
+def cache_stats() -> dict:
+    with _plans_lock, _probes_lock:
+        return {
+            **_stats,
+            "plans_cached": len(_plans),
+            "probes_cached": len(_probes),
+        }
@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+import uuid
+from contextlib import closing
+import finale
+import job_queue
+from workspace import create_workspace, owner_alive, process_owner
+from local_db import connect
+
+# Only full-quality renders queue here, so they run first come, first served.
+# Previews render straight away in the request that asked for them.
+_jobs = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+_schema_ready = False
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS renders (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                background_url TEXT,
+                overlay_url TEXT,
+                owner TEXT,
+                preview_url TEXT,
+                final_url TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Tables created before final renders were recoverable lack these columns
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(renders)")}
+        for column in ("background_url", "overlay_url", "owner"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE renders ADD COLUMN {column} TEXT")
+    _schema_ready = True
+
+
+def _update_render(render_id: str, **fields):
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with closing(connect()) as conn:
+        conn.execute(
+            f"UPDATE renders SET {assignments}, updated_at = ? WHERE id = ?",
+            (*fields.values(), time.time(), render_id),
+        )
+
+
+def get_render(render_id: str) -> dict | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute("SELECT * FROM renders WHERE id = ?", (render_id,)).fetchone()
+
+    if row is None:
+        return None
+    render = dict(row)
+    # The final render replaces the proxy as soon as it exists
+    render["video_url"] = render["final_url"] or render["preview_url"]
+    return render
+
+
+def _run_worker():
+    while True:
+        job = _jobs.get()
+        try:
+            job()
+        except Exception as e:
+            print(f"[render queue] Job failed: {e}")
+        finally:
+            _jobs.task_done()
+
+
+def enqueue(job):
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, name="render-queue", daemon=True)
+            _worker.start()
+    _jobs.put(job)
+
+
+def _final_render_job(render_id: str, inputs: dict):
+    def job():
+        try:
+            _update_render(render_id, status="rendering_final")
+            if inputs.get("workspace") is None:
+                # Recovered after a restart: the preview's downloads went with the old process
+                inputs["workspace"] = create_workspace("render")
+                inputs.update(finale.prepare_overlay_inputs(inputs["background_url"], inputs["overlay_url"], inputs["workspace"]))
+            final_url = finale.render_and_upload(inputs)
+            _update_render(render_id, status="completed", final_url=final_url)
+        except Exception as e:
+            _update_render(render_id, status="failed", error=str(e))
+            raise
+        finally:
+            if inputs.get("workspace") is not None:
+                inputs["workspace"].cleanup()
+    return job
+
+
+def render_preview(background_url: str, overlay_url: str) -> dict:
+    _ensure_schema()
+    render_id = str(uuid.uuid4())
+    now = time.time()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO renders (id, status, background_url, overlay_url, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (render_id, "rendering_preview", background_url, overlay_url, process_owner(), now, now),
+        )
+
+    # Kept until the queued final render is done with the shared inputs
+    workspace = create_workspace("render")
+    try:
+        inputs = finale.prepare_overlay_inputs(background_url, overlay_url, workspace)
+        preview_url = finale.render_and_upload(inputs, preview=True)
+    except BaseException as e:
+        workspace.cleanup()
+        _update_render(render_id, status="failed", error=str(e))
+        raise
+
+    _update_render(render_id, status="preview", preview_url=preview_url)
+    enqueue(_final_render_job(render_id, inputs))
+    return get_render(render_id)
+
+
+async def queue_preview(background_url: str, overlay_url: str) -> dict:
+    # Queue mode: the render is tracked here and workers, on any node, only render and upload.
+    # Without an owner the render is left to the overlay_final job instead of recover_renders()
+    _ensure_schema()
+    render_id = str(uuid.uuid4())
+    now = time.time()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT INTO renders (id, status, background_url, overlay_url, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (render_id, "rendering_preview", background_url, overlay_url, now, now),
+        )
+
+    payload = {"render_id": render_id, "background_url": background_url, "overlay_url": overlay_url}
+    result = await job_queue.run_job("overlay_preview", payload)
+    return {"id": render_id, "status": "preview", "video_url": result["preview_url"]}
+
+
+def preview_rendered(payload: dict, preview_url: str):
+    # A durable job any worker can take, retried if its worker is lost; it downloads the inputs again
+    _update_render(payload["render_id"], status="preview", preview_url=preview_url)
+    job_queue.enqueue("overlay_final", payload, priority=job_queue.BACKGROUND_PRIORITY)
+
+
+def final_rendered(render_id: str, final_url: str):
+    _update_render(render_id, status="completed", final_url=final_url)
+
+
+def render_failed(render_id: str, error: str):
+    _update_render(render_id, status="failed", error=error)
+
+
+def recover_renders() -> int:
+    # Re-queues final renders whose process died before finishing them; the inputs are downloaded again
+    _ensure_schema()
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            "SELECT id, owner, background_url, overlay_url FROM renders WHERE status IN ('preview', 'rendering_final')"
+        ).fetchall()
+
+    recovered = 0
+    for row in rows:
+        # Renders without an owner are finished by an overlay_final job instead
+        if not row["owner"] or not row["background_url"] or owner_alive(row["owner"]):
+            continue
+        # Several API processes start together; the one that swaps in its own owner takes the render
+        with closing(connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE renders SET owner = ?, updated_at = ? WHERE id = ? AND owner IS ?",
+                (process_owner(), time.time(), row["id"], row["owner"]),
+            )
+        if cursor.rowcount:
+            enqueue(_final_render_job(row["id"], {"background_url": row["background_url"], "overlay_url": row["overlay_url"]}))
+            recovered += 1
+
+    if recovered:
+        print(f"[render queue] Recovered {recovered} final renders")
+    return recovered
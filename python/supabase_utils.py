@@ -1,7 +1,14 @@
-from supabase import create_client, Client
 from dotenv import load_dotenv
-import uuid
+from lazy_imports import lazy_import
+import hashlib
+import time
 import os
+import uuid
+import requests
+from contextlib import closing, nullcontext
+from local_db import connect
+
+supabase = lazy_import("supabase")
 
 # Load environment variables
 load_dotenv()
@@ -10,35 +17,114 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SUPABASE_BUCKET = "videos"
 
+REHOST_CHUNK_BYTES = 1024 * 1024
+HASH_CHUNK_BYTES = 1024 * 1024
 
-def upload_to_supabase(file_path: str, content_type: str = "image/png") -> str:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-    filename = os.path.basename(file_path)
-
-    # Generate unique filename
-    if content_type == "image/png":
-        unique_filename = f"{filename}-{uuid.uuid4()}.png"
-    elif content_type == "audio/mpeg":
-        unique_filename = f"{filename}-{uuid.uuid4()}.mp3"
-    elif content_type == "video/mp4":
-        unique_filename = f"{filename}-{uuid.uuid4()}.mp4"
-    elif content_type == "video/quicktime":
-        unique_filename = f"{filename}-{uuid.uuid4()}.mov"
-    elif content_type == "video/webm":
-        unique_filename = f"{filename}-{uuid.uuid4()}.webm"
-    else:
-        raise Exception(f"Unsupported content type: {content_type}")
+# Content-addressed objects live here; a key never points at different bytes, so CDNs may cache forever
+CONTENT_FOLDER = "objects"
+# Streamed uploads land here until their hash, and so their content key, is known
+STAGING_FOLDER = "staging"
+# storage3 prefixes this with "max-age="
+IMMUTABLE_CACHE_CONTROL = "31536000, immutable"
 
-    storage_path = f"{unique_filename}"
+_schema_ready = False
 
-    with open(file_path, "rb") as f:
-        res = supabase.storage.from_(SUPABASE_BUCKET).upload(
-            storage_path,
-            f,
-            file_options={"content-type": content_type},
+
+EXTENSIONS = {
+    "image/png": "png",
+    "audio/mpeg": "mp3",
+    "video/mp4": "mp4",
+    "video/quicktime": "mov",
+    "video/webm": "webm",
+}
+
+
+def _ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with closing(connect()) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS storage_objects (
+                sha256 TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                storage_path TEXT NOT NULL,
+                public_url TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, content_type)
+            )
+        """)
+    _schema_ready = True
+
+
+def _indexed_url(digest: str, content_type: str) -> str | None:
+    _ensure_schema()
+    with closing(connect()) as conn:
+        row = conn.execute(
+            "SELECT public_url FROM storage_objects WHERE sha256 = ? AND content_type = ?", (digest, content_type)
+        ).fetchone()
+    return row["public_url"] if row else None
+
+
+def _index(digest: str, storage_path: str, public_url: str, content_type: str):
+    _ensure_schema()
+    with closing(connect()) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO storage_objects (sha256, content_type, storage_path, public_url, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (digest, content_type, storage_path, public_url, time.time()),
         )
 
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _content_storage_path(digest: str, content_type: str) -> str:
+    if content_type not in EXTENSIONS:
+        raise Exception(f"Unsupported content type: {content_type}")
+    return f"{CONTENT_FOLDER}/{digest}.{EXTENSIONS[content_type]}"
+
+
+def _public_url(client, storage_path: str) -> str:
+    public_url_response = client.storage.from_(SUPABASE_BUCKET).get_public_url(storage_path)
+
+    # Handle different response types safely
+    if isinstance(public_url_response, str):
+        return public_url_response
+    if hasattr(public_url_response, "public_url"):
+        return public_url_response.public_url
+    if isinstance(public_url_response, dict):
+        return public_url_response.get("publicUrl")
+    print("Could not determine public URL from response")
+    raise Exception("Could not determine public URL from response")
+
+
+def _object_exists(client, storage_path: str) -> bool:
+    folder, name = storage_path.rsplit("/", 1)
+    entries = client.storage.from_(SUPABASE_BUCKET).list(folder, {"search": name})
+    return any(entry.get("name") == name for entry in entries or [])
+
+
+def _upload(body, storage_path: str, content_type: str, immutable: bool = False) -> str:
+    client = supabase.create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+
+    file_options = {"content-type": content_type}
+    if immutable:
+        # Same key always means same bytes, so a concurrent upload of it can safely overwrite
+        file_options.update({"cache-control": IMMUTABLE_CACHE_CONTROL, "upsert": "true"})
+
+    res = client.storage.from_(SUPABASE_BUCKET).upload(
+        storage_path,
+        body,
+        file_options=file_options,
+    )
+
     # Handle both object and dict responses
     error = getattr(res, "error", None)
     if error:
@@ -46,18 +132,104 @@ def upload_to_supabase(file_path: str, content_type: str = "image/png") -> str:
         raise Exception(f"Upload failed: {getattr(error, 'message', str(error))}")
 
     # Get public URL
-    public_url_response = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(storage_path)
+    public_url = _public_url(client, storage_path)
+    print(f"Uploaded to Supabase: {public_url}")
+    return public_url
 
-    # Handle different response types safely
-    if isinstance(public_url_response, str):
-        public_url = public_url_response
-    elif hasattr(public_url_response, "public_url"):
-        public_url = public_url_response.public_url
-    elif isinstance(public_url_response, dict):
-        public_url = public_url_response.get("publicUrl")
+
+def _upload_content(digest: str, open_body, content_type: str) -> str:
+    # Identical content always maps to the same key and URL, so repeat uploads are no-ops
+    public_url = _indexed_url(digest, content_type)
+    if public_url:
+        print(f"Already in Supabase: {public_url}")
+        return public_url
+
+    storage_path = _content_storage_path(digest, content_type)
+    client = supabase.create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    if _object_exists(client, storage_path):
+        public_url = _public_url(client, storage_path)
+        print(f"Already in Supabase: {public_url}")
     else:
-        print("Could not determine public URL from response")
-        raise Exception("Could not determine public URL from response")
+        with open_body() as body:
+            public_url = _upload(body, storage_path, content_type, immutable=True)
+
+    _index(digest, storage_path, public_url, content_type)
+    return public_url
+
+
+def upload_bytes_to_supabase(data: bytes, filename: str, content_type: str = "image/png") -> str:
+    # filename only names the artifact in logs; the key comes from the content
+    print(f"Uploading {filename} to Supabase")
+    return _upload_content(hashlib.sha256(data).hexdigest(), lambda: nullcontext(data), content_type)
+
+
+def upload_to_supabase(file_path: str, content_type: str = "image/png") -> str:
+    return _upload_content(_file_sha256(file_path), lambda: open(file_path, "rb"), content_type)
+
+
+def _stream_upload(chunks, storage_path: str, content_type: str, immutable: bool = False):
+    # storage3 only uploads bytes or local files, so streamed bodies go to the Storage REST API directly
+    headers = {
+        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
+        "apikey": SUPABASE_SERVICE_ROLE_KEY,
+        "Content-Type": content_type,
+    }
+    if immutable:
+        headers.update({"Cache-Control": f"max-age={IMMUTABLE_CACHE_CONTROL}", "x-upsert": "true"})
+
+    response = requests.post(
+        f"{SUPABASE_URL}/storage/v1/object/{SUPABASE_BUCKET}/{storage_path}",
+        data=chunks,
+        headers=headers,
+        timeout=(10, 300),
+    )
+    if not response.ok:
+        print(f"Upload failed: {response.status_code} {response.text}")
+        raise Exception(f"Upload failed: {response.status_code} {response.text}")
+
+
+def _promote(staged_path: str, digest: str, content_type: str) -> str:
+    # Moves a staged upload to its content key, or drops it when those bytes are already stored
+    client = supabase.create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    bucket = client.storage.from_(SUPABASE_BUCKET)
+    storage_path = _content_storage_path(digest, content_type)
+
+    if _indexed_url(digest, content_type) or _object_exists(client, storage_path):
+        bucket.remove([staged_path])
+    else:
+        try:
+            bucket.move(staged_path, storage_path)
+        except Exception:
+            # A concurrent rehost of the same bytes can win the move
+            if not _object_exists(client, storage_path):
+                raise
+            bucket.remove([staged_path])
+
+    public_url = _public_url(client, storage_path)
+    _index(digest, storage_path, public_url, content_type)
+    print(f"Uploaded to Supabase: {public_url}")
+    return public_url
+
+
+def rehost_url_to_supabase(url: str, content_type: str = "video/mp4", storage_path: str = None) -> str:
+    # The download is piped straight into the upload, so nothing is buffered in memory or on disk.
+    # Without a storage_path the object is content-addressed like any other upload: it is staged
+    # while being hashed, then moved to its content key.
+    digest = hashlib.sha256()
+
+    def chunks(response):
+        for chunk in response.iter_content(chunk_size=REHOST_CHUNK_BYTES):
+            digest.update(chunk)
+            yield chunk
+
+    target_path = storage_path or f"{STAGING_FOLDER}/{uuid.uuid4()}.{EXTENSIONS.get(content_type, 'bin')}"
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        _stream_upload(chunks(response), target_path, content_type, immutable=storage_path is None)
 
+    if storage_path is None:
+        return _promote(target_path, digest.hexdigest(), content_type)
+    client = supabase.create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+    public_url = _public_url(client, storage_path)
     print(f"Uploaded to Supabase: {public_url}")
     return public_url
@@ -0,0 +1,72 @@
+import background_removal
+import finale
+import render_queue
+
+# CPU-heavy work that can run either in the API process or in worker.py processes, on this host or another.
+# Each task takes the JSON payload stored with the job and returns a JSON-serializable result.
+# Tasks only touch storage every node can reach; state kept in the API's database is updated by the
+# completion and failure handlers, which run wherever the queue lives.
+
+
+def overlay_render(payload: dict) -> dict:
+    video_url = finale.overlay_videos_and_upload(payload["background_url"], payload["overlay_url"])
+    return {"video_url": video_url}
+
+
+def overlay_preview(payload: dict) -> dict:
+    if "render_id" not in payload:
+        # Inline mode: the final render reuses this process's downloads
+        return render_queue.render_preview(payload["background_url"], payload["overlay_url"])
+    # Queue mode: the API tracks the render and queues the full-quality render once this completes
+    preview_url = finale.overlay_videos_and_upload(payload["background_url"], payload["overlay_url"], preview=True)
+    return {"render_id": payload["render_id"], "preview_url": preview_url}
+
+
+def overlay_final(payload: dict) -> dict:
+    final_url = finale.overlay_videos_and_upload(payload["background_url"], payload["overlay_url"])
+    return {"render_id": payload["render_id"], "final_url": final_url}
+
+
+def remove_background_image(payload: dict) -> dict:
+    return {"background_removed_url": background_removal.remove_background_from_supabase_url(payload["image_url"])}
+
+
+def remove_background_images(payload: dict) -> dict:
+    return {"results": background_removal.remove_background_from_urls(payload["image_urls"])}
+
+
+def remove_background_video(payload: dict) -> dict:
+    return {"background_removed_url": background_removal.remove_background_from_video_url(payload["video_url"])}
+
+
+TASKS = {
+    "overlay_render": overlay_render,
+    "overlay_preview": overlay_preview,
+    "overlay_final": overlay_final,
+    "remove_background_image": remove_background_image,
+    "remove_background_images": remove_background_images,
+    "remove_background_video": remove_background_video,
+}
+
+
+def overlay_preview_completed(payload: dict, result: dict):
+    render_queue.preview_rendered(payload, result["preview_url"])
+
+
+def overlay_final_completed(payload: dict, result: dict):
+    render_queue.final_rendered(payload["render_id"], result["final_url"])
+
+
+def overlay_render_failed(payload: dict, error: str):
+    render_queue.render_failed(payload["render_id"], error)
+
+
+# Called with the job's payload and result, or error, once a queued job ends
+COMPLETION_HANDLERS = {
+    "overlay_preview": overlay_preview_completed,
+    "overlay_final": overlay_final_completed,
+}
+FAILURE_HANDLERS = {
+    "overlay_preview": overlay_render_failed,
+    "overlay_final": overlay_render_failed,
+}
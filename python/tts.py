@@ -1,23 +1,34 @@
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
 import os
-from tempfile import NamedTemporaryFile
+import threading
 from supabase_utils import upload_to_supabase
+from workspace import job_workspace
+from lazy_imports import lazy_import
 
 load_dotenv()
 
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
-if not ELEVENLABS_API_KEY:
-    raise ValueError("❌ ELEVENLABS_API_KEY not set in environment!")
 
-# Initialize ElevenLabs client
-elevenlabs = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+elevenlabs_client = lazy_import("elevenlabs.client")
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # The ElevenLabs client is created on first use rather than at import
+    global _client
+    with _client_lock:
+        if _client is None:
+            if not ELEVENLABS_API_KEY:
+                raise ValueError("❌ ELEVENLABS_API_KEY not set in environment!")
+            _client = elevenlabs_client.ElevenLabs(api_key=ELEVENLABS_API_KEY)
+    return _client
 
 
 def tts_from_script(script):
     try:
         # Generate the audio as a stream of chunks (generator)
-        audio_generator = elevenlabs.text_to_speech.convert(
+        audio_generator = get_client().text_to_speech.convert(
             text=script,
             voice_id="sIsyDvq54C8vCgtvpJac",
             model_id="eleven_multilingual_v2",
@@ -25,20 +36,15 @@ def tts_from_script(script):
             voice_settings= {"speed": 1.05}
         )
 
-        # Write the streamed chunks into a temp .mp3 file
-        with NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-            for chunk in audio_generator:
-                tmp_file.write(chunk)
-            audio_file_path = tmp_file.name
-
-        print(f"✅ Audio file written at: {audio_file_path}")
+        # Write the streamed chunks into a .mp3 file, removed whether or not the upload succeeds
+        with job_workspace("tts", fast=True) as workspace:
+            audio_file_path = workspace.write_chunks("narration.mp3", audio_generator)
 
-        # Upload to Supabase (set correct audio MIME type)
-        public_url = upload_to_supabase(audio_file_path, content_type="audio/mpeg")
-        print(f"✅ Final Public URL: {public_url}")
+            print(f"✅ Audio file written at: {audio_file_path}")
 
-        # Optional: Clean up temp file after upload
-        os.remove(audio_file_path)
+            # Upload to Supabase (set correct audio MIME type)
+            public_url = upload_to_supabase(audio_file_path, content_type="audio/mpeg")
+            print(f"✅ Final Public URL: {public_url}")
 
         return public_url
 
@@ -1,5 +1,5 @@
 import asyncio
-import fal_client
+import fal_jobs
 from dotenv import load_dotenv
 import sys
 
@@ -7,39 +7,33 @@ import sys
 load_dotenv()
 
 
-async def generate_avatar_video(audio_url: str) -> dict:
-    handler = await fal_client.submit_async(
+async def generate_avatar_video(audio_url: str, wait: bool = True, follow_up: str = None) -> dict:
+    # With a webhook configured and wait=False this returns the queued job record
+    result = await fal_jobs.run(
         "veed/avatars/audio-to-video",
-        arguments={
+        {
             "avatar_id": "marcus_primary",
             "audio_url": audio_url
         },
+        wait=wait,
+        stream_logs=True,
+        follow_up=follow_up,
     )
-
-    # Optionally print logs
-    async for event in handler.iter_events(with_logs=True):
-        print(event)
-
-    result = await handler.get()
     print(result)
 
     return result
 
 
-async def lip_sync_video_audio(video_url: str, audio_url: str) -> dict:
-    handler = await fal_client.submit_async(
+async def lip_sync_video_audio(video_url: str, audio_url: str, wait: bool = True) -> dict:
+    result = await fal_jobs.run(
         "veed/lipsync",
-        arguments={
+        {
             "video_url": video_url,
             "audio_url": audio_url
         },
+        wait=wait,
+        stream_logs=True,
     )
-
-    # Optionally print logs
-    async for event in handler.iter_events(with_logs=True):
-        print(event)
-
-    result = await handler.get()
     print(result)
 
     return result
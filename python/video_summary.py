@@ -0,0 +1,39 @@
+import asyncio
+from dotenv import load_dotenv
+from lazy_imports import lazy_import
+from cancellation import await_sieve
+
+sieve = lazy_import("sieve")
+
+# Load environment variables
+load_dotenv()
+
+
+def push_summary_job(video_url: str, prompt: str):
+    video = sieve.File(url=video_url)
+    start_time = 0
+    end_time = -1
+    backend = "sieve-fast"
+
+    ask = sieve.function.get("sieve/ask")
+    output = ask.push(
+        video,
+        prompt,
+        start_time,
+        end_time,
+        backend
+    )
+    print('This is printing while a job is running in the background!')
+    return output
+
+
+def summarize_video(video_url: str, prompt: str) -> str:
+    # Blocks until the Sieve job has finished
+    return push_summary_job(video_url, prompt).result()
+
+
+async def summarize_video_async(video_url: str, prompt: str) -> str:
+    # Cancelling the awaiting task also cancels the Sieve job
+    loop = asyncio.get_running_loop()
+    output = await loop.run_in_executor(None, push_summary_job, video_url, prompt)
+    return await await_sieve(output, model="sieve/ask")
@@ -0,0 +1,109 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import encoder
+import job_queue
+import remote_queue
+import workspace
+from tasks import TASKS
+
+# Usage: RENDER_MODE=queue on the API, then either on the same host, sharing its LOCAL_DB_PATH:
+#   python worker.py --concurrency 4 [--kinds overlay_render,overlay_preview,overlay_final]
+# or on any other node, through the API's /worker/jobs endpoints:
+#   JOB_QUEUE_URL=https://api.example JOB_WORKER_TOKEN=... python worker.py --concurrency 4
+IDLE_POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15
+# Back-off after the queue could not be reached
+RETRY_SECONDS = 5
+
+
+def _keep_alive(queue, job_id: str, worker_id: str, done: threading.Event):
+    while not done.wait(HEARTBEAT_SECONDS):
+        try:
+            queue.heartbeat(job_id, worker_id)
+        except Exception as e:
+            print(f"[{worker_id}] Heartbeat for job {job_id} failed: {e}")
+
+
+def work_loop(worker_id: str, kinds: list[str], encoder_threads: int, api_url: str | None):
+    # Workers on one node share its cores instead of each assuming the whole machine;
+    # each process runs one job at a time, so its encodes get all of its share
+    encoder.CPU_COUNT = encoder_threads
+    encoder.EXPECTED_CONCURRENT_ENCODES = 1
+    queue = job_queue
+    if api_url:
+        remote_queue.JOB_QUEUE_URL = api_url.rstrip("/")
+        queue = remote_queue
+    print(f"[{worker_id}] Started for {kinds} with {encoder_threads} encoder threads")
+
+    while True:
+        try:
+            queue.requeue_stale_jobs()
+            job = queue.claim(worker_id, kinds)
+        except Exception as e:
+            print(f"[{worker_id}] Could not claim a job: {e}")
+            time.sleep(RETRY_SECONDS)
+            continue
+        if job is None:
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+
+        print(f"[{worker_id}] Running {job['kind']} job {job['id']}")
+        done = threading.Event()
+        threading.Thread(target=_keep_alive, args=(queue, job["id"], worker_id, done), daemon=True).start()
+        try:
+            try:
+                result = TASKS[job["kind"]](job["payload"])
+            except Exception as e:
+                print(f"[{worker_id}] Job {job['id']} failed: {e}")
+                queue.fail(job["id"], str(e), worker_id)
+            else:
+                if queue.complete(job["id"], result, worker_id):
+                    print(f"[{worker_id}] Completed job {job['id']}")
+                else:
+                    print(f"[{worker_id}] Job {job['id']} was requeued before it completed")
+        except Exception as e:
+            # The queue was unreachable; the job is requeued once its heartbeat goes stale
+            print(f"[{worker_id}] Could not report job {job['id']}: {e}")
+        finally:
+            done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run render and transcode workers")
+    parser.add_argument("--concurrency", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--kinds", default=",".join(TASKS), help="Comma-separated job kinds to accept")
+    parser.add_argument(
+        "--api-url",
+        default=remote_queue.JOB_QUEUE_URL,
+        help="Claim jobs through this API instead of a local LOCAL_DB_PATH (default: JOB_QUEUE_URL)",
+    )
+    args = parser.parse_args()
+
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    unknown = set(kinds) - set(TASKS)
+    if unknown:
+        parser.error(f"Unknown job kinds: {', '.join(sorted(unknown))}")
+
+    if args.api_url and not remote_queue.JOB_WORKER_TOKEN:
+        parser.error("JOB_WORKER_TOKEN is required to claim jobs through the API")
+
+    workspace.start_janitor()
+    encoder_threads = max(1, (os.cpu_count() or 1) // args.concurrency)
+
+    processes = []
+    for index in range(args.concurrency):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+        process = multiprocessing.Process(target=work_loop, args=(worker_id, kinds, encoder_threads, args.api_url), name=worker_id)
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
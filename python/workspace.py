@@ -0,0 +1,233 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Per-job directories live under these roots; the fast root should be tmpfs-backed
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "petventures"))
+FAST_WORKSPACE_ROOT = os.getenv("FAST_WORKSPACE_ROOT", "/dev/shm/petventures")
+
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_MB", "2048")) * 1024 * 1024
+FAST_WORKSPACE_QUOTA_BYTES = int(os.getenv("FAST_WORKSPACE_QUOTA_MB", "128")) * 1024 * 1024
+
+# Workspaces whose owner has not heartbeated for this long are removed even if it looks alive
+ORPHAN_MAX_AGE_SECONDS = int(os.getenv("WORKSPACE_ORPHAN_MAX_AGE", str(6 * 60 * 60)))
+JANITOR_INTERVAL_SECONDS = 15 * 60
+# Owners touch their .owner files this often for as long as the workspace is in use
+HEARTBEAT_SECONDS = 5 * 60
+# How often a running tool's output is checked against the quota
+QUOTA_POLL_SECONDS = 1.0
+
+OWNER_FILE = ".owner"
+
+# Workspaces this process has created and not yet cleaned up
+_live_workspaces = set()
+_live_lock = threading.Lock()
+_heartbeat = None
+
+
+class WorkspaceQuotaExceeded(Exception):
+    pass
+
+
+class Workspace:
+    def __init__(self, path: str, quota_bytes: int):
+        self.path = path
+        self.quota_bytes = quota_bytes
+
+    def path_for(self, filename: str) -> str:
+        return os.path.join(self.path, os.path.basename(filename))
+
+    def used_bytes(self) -> int:
+        total = 0
+        for directory, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                total += os.path.getsize(os.path.join(directory, filename))
+        return total
+
+    def check_quota(self, extra_bytes: int = 0):
+        used = self.used_bytes()
+        if used + extra_bytes > self.quota_bytes:
+            raise WorkspaceQuotaExceeded(
+                f"Workspace {self.path} would use {used + extra_bytes} bytes, quota is {self.quota_bytes}"
+            )
+
+    def write_bytes(self, filename: str, data: bytes) -> str:
+        self.check_quota(len(data))
+        path = self.path_for(filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def write_chunks(self, filename: str, chunks) -> str:
+        # For streamed bodies whose size is only known once they are written
+        path = self.path_for(filename)
+        written = 0
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+                if written >= self.quota_bytes // 16:
+                    self.check_quota()
+                    written = 0
+        self.check_quota()
+        return path
+
+    def run(self, command: list[str]) -> subprocess.CompletedProcess:
+        # Runs a tool that writes into the workspace and stops it as soon as the workspace outgrows its quota
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        try:
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=QUOTA_POLL_SECONDS)
+                    break
+                except subprocess.TimeoutExpired:
+                    self.check_quota()
+        except BaseException:
+            process.kill()
+            process.communicate()
+            raise
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        self.check_quota()
+        return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+    def cleanup(self):
+        with _live_lock:
+            _live_workspaces.discard(self.path)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _fast_root_usable() -> bool:
+    parent = os.path.dirname(FAST_WORKSPACE_ROOT.rstrip("/")) or "/"
+    return os.path.isdir(parent) and os.access(parent, os.W_OK)
+
+
+def create_workspace(name: str, fast: bool = False, quota_bytes: int = None) -> Workspace:
+    # Callers that hand the workspace to a later job must call cleanup() themselves
+    use_fast = fast and _fast_root_usable()
+    root = FAST_WORKSPACE_ROOT if use_fast else WORKSPACE_ROOT
+    if quota_bytes is None:
+        quota_bytes = FAST_WORKSPACE_QUOTA_BYTES if use_fast else WORKSPACE_QUOTA_BYTES
+
+    os.makedirs(root, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{name}-", dir=root)
+    with open(os.path.join(path, OWNER_FILE), "w") as f:
+        f.write(process_owner())
+
+    with _live_lock:
+        _live_workspaces.add(path)
+    _start_heartbeat()
+    return Workspace(path, quota_bytes)
+
+
+def _start_heartbeat():
+    # Keeps workspaces held across queued jobs from looking abandoned, however long they wait
+    global _heartbeat
+
+    def run():
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            with _live_lock:
+                paths = list(_live_workspaces)
+            for path in paths:
+                try:
+                    os.utime(os.path.join(path, OWNER_FILE))
+                except OSError:
+                    pass
+
+    with _live_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=run, name="workspace-heartbeat", daemon=True)
+            _heartbeat.start()
+
+
+@contextmanager
+def job_workspace(name: str, fast: bool = False, quota_bytes: int = None):
+    workspace = create_workspace(name, fast, quota_bytes)
+    try:
+        yield workspace
+    finally:
+        # Runs on success, on errors and on task cancellation alike
+        workspace.cleanup()
+
+
+def process_owner() -> str:
+    # Identifies this process in .owner files and other records of who holds a resource
+    return f"{socket.gethostname()} {os.getpid()}"
+
+
+def owner_alive(owner: str) -> bool:
+    try:
+        hostname, pid = owner.split()
+    except ValueError:
+        return False
+
+    # Only processes on this host can be checked; others are judged by age alone
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_alive(path: str) -> bool:
+    try:
+        with open(os.path.join(path, OWNER_FILE)) as f:
+            return owner_alive(f.read())
+    except OSError:
+        return False
+
+
+def clean_orphaned_workspaces() -> int:
+    removed = 0
+    now = time.time()
+
+    for root in (WORKSPACE_ROOT, FAST_WORKSPACE_ROOT):
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not os.path.isdir(path):
+                continue
+            owner_path = os.path.join(path, OWNER_FILE)
+            try:
+                # The owner file's mtime is its owner's last heartbeat
+                age = now - os.path.getmtime(owner_path if os.path.exists(owner_path) else path)
+            except OSError:
+                continue
+            # Skip brand new directories whose owner file may not be written yet
+            if age < 60:
+                continue
+            if age > ORPHAN_MAX_AGE_SECONDS or not _owner_alive(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+
+    if removed:
+        print(f"[workspace] Removed {removed} orphaned workspaces")
+    return removed
+
+
+def start_janitor():
+    def run():
+        while True:
+            try:
+                clean_orphaned_workspaces()
+            except Exception as e:
+                print(f"[workspace] Janitor failed: {e}")
+            time.sleep(JANITOR_INTERVAL_SECONDS)
+
+    threading.Thread(target=run, name="workspace-janitor", daemon=True).start()
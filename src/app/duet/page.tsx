@@ -94,12 +94,11 @@ export default function Duet() {
     setProcessingStatus('processing');
     
     try {
-      // Call the API to generate duet with user ID for storage
+      // The signed-in user's access token goes with the request, so the duet is stored under them
       const result = await generateDuet(
         prompt, 
         myPetProfile.profile_image_url, 
-        selectedPet.profile_image_url,
-        user?.id // Pass user ID for storage
+        selectedPet.profile_image_url
       );
       
       if (result.status === 'success') {
@@ -0,0 +1,12 @@
+import { supabaseBrowser } from './supabase-browser';
+
+// Headers for calls to the Python API. The signed-in user's access token lets the API
+// verify who is calling; without one the API budgets the caller as anonymous.
+export async function apiHeaders(): Promise<Record<string, string>> {
+  const { data } = await supabaseBrowser().auth.getSession();
+  const token = data.session?.access_token;
+  return {
+    'Content-Type': 'application/json',
+    ...(token ? { Authorization: `Bearer ${token}` } : {}),
+  };
+}
@@ -1,3 +1,5 @@
+import { apiHeaders } from './api-headers';
+
 interface GenerateRequest {
   prompt: string;
   imageUrl?: string;
@@ -67,6 +69,53 @@ interface VideoOverlayResponse {
   stored_url?: string;
 }
 
+interface FalJobRecord {
+  request_id: string;
+  status: string;
+  result?: any;
+  error?: string;
+  progress?: {
+    estimated_completion_at?: number;
+  } | null;
+}
+
+// Matches the API's FAL_JOB_TIMEOUT_SECONDS, after which it gives up on a fal job too
+const FAL_JOB_TIMEOUT_SECONDS = Number(process.env.NEXT_PUBLIC_FAL_JOB_TIMEOUT_SECONDS ?? 1800);
+
+// With fal webhooks enabled the API answers with a queued job record instead of the result,
+// so poll /fal-jobs/ until the webhook has delivered it
+async function waitForFalJob(apiUrl: string, response: any): Promise<any> {
+  if (!response?.request_id || response.video || response.video_url) {
+    return response;
+  }
+
+  const deadline = Date.now() + FAL_JOB_TIMEOUT_SECONDS * 1000;
+  while (true) {
+    if (Date.now() >= deadline) {
+      throw new Error(`Fal job ${response.request_id} did not finish within ${FAL_JOB_TIMEOUT_SECONDS}s`);
+    }
+
+    const jobResponse = await fetch(`${apiUrl}/fal-jobs/${response.request_id}`);
+    if (!jobResponse.ok) {
+      throw new Error(`Fal job API error: ${jobResponse.status}`);
+    }
+    const job: FalJobRecord = await jobResponse.json();
+    if (job.status === 'COMPLETED') {
+      return job.result;
+    }
+    if (job.status === 'FAILED' || job.status === 'CANCELLED') {
+      throw new Error(`Fal job ${job.request_id} failed: ${job.error ?? job.status}`);
+    }
+
+    // Poll more often as the server's estimate approaches, between 2 and 15 seconds
+    const secondsLeft = job.progress?.estimated_completion_at
+      ? job.progress.estimated_completion_at - Date.now() / 1000
+      : 10;
+    const delaySeconds = Math.min(15, Math.max(2, secondsLeft / 2));
+    await new Promise(resolve => setTimeout(resolve, delaySeconds * 1000));
+  }
+}
+
 export async function generateAdventure(
   prompt: string,
   imageUrl?: string,
@@ -78,13 +127,14 @@ export async function generateAdventure(
     throw new Error('API URL not defined in environment variables');
   }
 
+  // Identifies the signed-in user to the API's per-user budgets
+  const headers = await apiHeaders();
+
   try {
     // Create both API requests to be executed concurrently
     const generateScenesPromise = fetch(`${API_URL}/generate-scenes/`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      headers,
       body: JSON.stringify({
         prompt,
       }),
@@ -95,9 +145,7 @@ export async function generateAdventure(
     if (imageUrl) {
       removeBackgroundPromise = fetch(`${API_URL}/remove-background/`, {
         method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
+        headers,
         body: JSON.stringify({
           image_url: imageUrl,
         }),
@@ -138,9 +186,7 @@ export async function generateAdventure(
             // Call generate-multiple-kling-videos API
             const klingResponse = await fetch(`${API_URL}/generate-multiple-kling-videos/`, {
               method: 'POST',
-              headers: {
-                'Content-Type': 'application/json',
-              },
+              headers,
               body: JSON.stringify({
                 prompts: scenePrompts,
                 image_url: backgroundRemovedUrl,
@@ -149,6 +195,18 @@ export async function generateAdventure(
             
             if (klingResponse.ok) {
               const klingData: MultiKlingResponse = await klingResponse.json();
+              klingData.results = await Promise.all(
+                klingData.results.map(async result => {
+                  if (result.status !== "processing") {
+                    return result;
+                  }
+                  try {
+                    return { ...result, result: await waitForFalJob(API_URL, result.result) };
+                  } catch (error) {
+                    return { ...result, status: "error", error: String(error) };
+                  }
+                })
+              );
               videoResults = klingData.results;
               
               // Extract video URLs from the results
@@ -162,9 +220,7 @@ export async function generateAdventure(
                   // First, make the stitch request
                   const stitchResponse = await fetch(`${API_URL}/stitch-scenes/`, {
                     method: 'POST',
-                    headers: {
-                      'Content-Type': 'application/json',
-                    },
+                    headers,
                     body: JSON.stringify({
                       scenes: videoUrls
                     }),
@@ -173,7 +229,7 @@ export async function generateAdventure(
                   // Process stitch response
                   let stitchData;
                   if (stitchResponse.ok) {
-                    stitchData = await stitchResponse.json();
+                    stitchData = await waitForFalJob(API_URL, await stitchResponse.json());
                   } else {
                     console.error(`Stitch scenes API error: ${stitchResponse.status}`);
                   }
@@ -182,9 +238,7 @@ export async function generateAdventure(
                   const summaryPromises = videoUrls.map(videoUrl => 
                     fetch(`${API_URL}/summary-of-videos/`, {
                       method: 'POST',
-                      headers: {
-                        'Content-Type': 'application/json',
-                      },
+                      headers,
                       body: JSON.stringify({
                         video_url: videoUrl,
                         prompt: "Summarise the video as if you were a David Attenborough style wildlife presenter"
@@ -230,9 +284,7 @@ export async function generateAdventure(
                       
                       const scriptResponse = await fetch(`${API_URL}/generate-script/`, {
                         method: 'POST',
-                        headers: {
-                          'Content-Type': 'application/json',
-                        },
+                        headers,
                         body: JSON.stringify({
                           video_summaries: videoSummaries,
                           scenes: scenesObj
@@ -253,9 +305,7 @@ export async function generateAdventure(
                             // First generate TTS, then use that for the avatar video
                             const ttsResponse = await fetch(`${API_URL}/tts-from-script/`, {
                               method: 'POST',
-                              headers: {
-                                'Content-Type': 'application/json',
-                              },
+                              headers,
                               body: JSON.stringify({
                                 text: scriptText
                               }),
@@ -272,9 +322,7 @@ export async function generateAdventure(
                                 // Call avatar video endpoint with the audio URL
                                 const avatarResponse = await fetch(`${API_URL}/generate-avatar-video/`, {
                                   method: 'POST',
-                                  headers: {
-                                    'Content-Type': 'application/json',
-                                  },
+                                  headers,
                                   body: JSON.stringify({
                                     audio_url: audioPathResult
                                   }),
@@ -283,7 +331,7 @@ export async function generateAdventure(
                                 // Process avatar video response
                                 let avatarVideoResult: any = undefined;
                                 if (avatarResponse.ok) {
-                                  avatarVideoResult = await avatarResponse.json();
+                                  avatarVideoResult = await waitForFalJob(API_URL, await avatarResponse.json());
                                   console.log("Avatar video API response:", avatarVideoResult);
                                   
                                   // Update variables with the results
@@ -297,9 +345,7 @@ export async function generateAdventure(
                                       // Call lip sync endpoint
                                       const lipSyncResponse = await fetch(`${API_URL}/lip-sync-video-audio/`, {
                                         method: 'POST',
-                                        headers: {
-                                          'Content-Type': 'application/json',
-                                        },
+                                        headers,
                                         body: JSON.stringify({
                                           video_url: avatarVideoResult.video.url,
                                           audio_url: audioPathResult
@@ -331,9 +377,7 @@ export async function generateAdventure(
                                             // Call final-overlay endpoint
                                             const finalOverlayResponse = await fetch(`${API_URL}/final-overlay/`, {
                                               method: 'POST',
-                                              headers: {
-                                                'Content-Type': 'application/json',
-                                              },
+                                              headers,
                                               body: JSON.stringify({
                                                 background_url: stitchData.video_url,
                                                 overlay_url: avatarVideoResult.video_url
@@ -1,3 +1,5 @@
+import { apiHeaders } from './api-headers';
+
 interface GenerateDuetRequest {
   prompt: string;
   imageUrl1: string;
@@ -13,11 +15,19 @@ interface GenerateDuetResponse {
   error?: string;
 }
 
+export interface DuetStatusEvent {
+  stage: string;
+  status: string;
+  queue_position?: number | null;
+  video_url?: string;
+  error?: string;
+}
+
 export async function generateDuet(
   prompt: string,
   imageUrl1: string,
   imageUrl2: string,
-  userId?: string
+  onStatus?: (event: DuetStatusEvent) => void
 ): Promise<GenerateDuetResponse> {
   const API_URL = process.env.NEXT_PUBLIC_API_URL;
   
@@ -26,12 +36,12 @@ export async function generateDuet(
   }
 
   try {
-    // Call the kling-duet endpoint directly with the provided images
-    const duetResponse = await fetch(`${API_URL}/generate-kling-duet/`, {
+    // The server removes both backgrounds, generates the duet and re-hosts it,
+    // streaming status events until the final video URL is ready
+    const duetResponse = await fetch(`${API_URL}/duets/`, {
       method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
+      // The API takes the user from the access token and stores the duet under their folder
+      headers: await apiHeaders(),
       body: JSON.stringify({
         prompt,
         image_url_1: imageUrl1,
@@ -39,67 +49,48 @@ export async function generateDuet(
       }),
     });
     
-    if (!duetResponse.ok) {
+    if (!duetResponse.ok || !duetResponse.body) {
       const errorText = await duetResponse.text();
       throw new Error(`Duet generation API error: ${duetResponse.status} - ${errorText}`);
     }
     
-    const result = await duetResponse.json();
+    const reader = duetResponse.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finalEvent: any = null;
     
-    // Check if video URL exists in the response
-    let videoUrl = null;
-    if (result.video && result.video.url) {
-      videoUrl = result.video.url;
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
       
-      // If userId is provided, we'll store the video in Supabase
-      if (userId) {
-        // Import supabase browser client dynamically to avoid server-side issues
-        const { supabaseBrowser } = await import('./supabase-browser');
-        const supabase = supabaseBrowser();
+      buffer += decoder.decode(value, { stream: true });
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop() || '';
+      
+      for (const message of messages) {
+        if (!message.startsWith('data: ')) continue;
+        const event = JSON.parse(message.slice('data: '.length));
+        onStatus?.(event);
         
-        try {
-          // Download the video
-          const videoResponse = await fetch(result.video.url);
-          
-          if (!videoResponse.ok) {
-            throw new Error(`Failed to download video: ${videoResponse.status}`);
-          }
-          
-          const videoBlob = await videoResponse.blob();
-          
-          // Generate a unique filename
-          const timestamp = new Date().getTime();
-          const filename = `duet_${timestamp}.mp4`;
-          const filePath = `${userId}/${filename}`;
-          
-          // Upload to Supabase storage
-          const { data, error } = await supabase.storage
-            .from('videos')
-            .upload(filePath, videoBlob, {
-              contentType: 'video/mp4',
-              cacheControl: '3600',
-            });
-            
-          if (error) {
-            console.error('Error uploading video to Supabase:', error);
-          } else {
-            // Get the public URL
-            const { data: { publicUrl } } = supabase.storage
-              .from('videos')
-              .getPublicUrl(filePath);
-              
-            videoUrl = publicUrl;
-          }
-        } catch (uploadError) {
-          console.error('Error processing video for storage:', uploadError);
+        if (event.stage === 'failed') {
+          throw new Error(event.error);
+        }
+        if (event.stage === 'completed') {
+          finalEvent = event;
         }
       }
     }
     
+    if (!finalEvent) {
+      throw new Error('Duet stream ended before the video was ready');
+    }
+    
     return {
       status: 'success',
-      result,
-      videoUrl,
+      result: finalEvent.result,
+      backgroundRemovedUrl1: finalEvent.background_removed_urls[0],
+      backgroundRemovedUrl2: finalEvent.background_removed_urls[1],
+      videoUrl: finalEvent.video_url,
     };
     
   } catch (error) {